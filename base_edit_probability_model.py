@@ -1,5 +1,7 @@
 
 class BaseEditProbabilityModel:
+    version = 0  # Bumped whenever the model changes, to invalidate caches
+
     def get_edit_logp(self, edited, original):
         """Gets the log-probability of editing `original` to arrive at `edited`.
         The `original` and `edited` arguments are both single terms that are at
@@ -20,3 +22,18 @@ class BaseEditProbabilityModel:
                 under this `EditProbabilityModel`.
         """
         raise NotImplementedError  # Force subclass to implement this method
+
+    def get_edit_logp_batch(self, edited_list, original):
+        """Gets the log-probabilities of editing `original` to arrive at each
+        term in `edited_list`. Subclasses may override this to score all the
+        candidates of a term at once.
+
+        Args:
+            edited_list (list of str): Edited terms.
+            original (str): Original term.
+
+        Returns:
+            logps (list of float): Log-probability of each edited term given
+                `original`, in the order of `edited_list`.
+        """
+        return [self.get_edit_logp(edited, original) for edited in edited_list]
@@ -0,0 +1,129 @@
+
+
+class LanguageModelArrays:
+    """Counts of a `LanguageModel` as NumPy arrays indexed by word id, for
+    scoring many candidate queries at once: the words of the candidates are
+    encoded as a matrix of ids, and their unigram and bigram counts are
+    gathered from the arrays with fancy indexing and `np.searchsorted`
+    instead of one Counter lookup per term.
+
+    Bigrams are keyed by id(w_1) * num_words + id(w_2), in a sorted array.
+    Words that are not in the vocabulary get id -1, which indexes the extra
+    count of 0 at the end of `unigram_counts`.
+    """
+
+    def __init__(self, lm):
+        """
+        Args:
+            lm (LanguageModel): Language model whose counts to copy.
+        """
+        self.lambda_ = lm.lambda_
+        self.total_num_tokens = lm.total_num_tokens
+        self.state = (id(lm), lm.version)
+
+        if isinstance(lm, CompactLanguageModel):
+            # Reuse the interned ids and the CSR arrays, already sorted by key
+            self.word_ids = lm.word_ids
+            num_words = len(lm.words)
+            bigrams = lm.bigram_counts
+            offsets = np.asarray(bigrams.offsets, dtype=np.int64)
+            id_1 = np.repeat(np.arange(num_words, dtype=np.int64), np.diff(offsets))
+            self.bigram_keys = id_1 * num_words + np.asarray(bigrams.next_ids, dtype=np.int64)
+            self.bigram_counts = np.asarray(bigrams.counts, dtype=np.float64)
+            unigram_counts = np.asarray(lm.unigram_counts.counts, dtype=np.float64)
+        else:
+            if isinstance(lm.bigram_counts, SketchBigramCounts):
+                raise TypeError('SketchLanguageModel bigram counts cannot be enumerated')
+            if isinstance(lm.bigram_counts, ShardedBigramCounts):
+                raise TypeError('ShardedLanguageModel bigram counts would all be read into memory')
+            words = sorted(lm.unigram_counts)
+            self.word_ids = {word: word_id for word_id, word in enumerate(words)}
+            num_words = len(words)
+            unigram_counts = np.fromiter((lm.unigram_counts[word] for word in words),
+                                         dtype=np.float64, count=num_words)
+            word_ids = self.word_ids
+            num_bigrams = len(lm.bigram_counts)
+            keys = np.fromiter((word_ids[w_1] * num_words + word_ids[w_2]
+                                for w_1, w_2 in lm.bigram_counts),
+                               dtype=np.int64, count=num_bigrams)
+            counts = np.fromiter(lm.bigram_counts.values(), dtype=np.float64, count=num_bigrams)
+            order = np.argsort(keys, kind='stable')
+            self.bigram_keys = keys[order]
+            self.bigram_counts = counts[order]
+
+        self.num_words = num_words
+        self.unigram_counts = np.append(unigram_counts, 0.)
+
+    def encode(self, queries):
+        """Encodes `queries` as a matrix of word ids.
+
+        Returns:
+            ids (np.ndarray): Array of shape (len(queries), max number of
+                terms), with -1 for unknown words and for padding.
+            lengths (np.ndarray): Number of terms of each query.
+        """
+        get_id = self.word_ids.get
+        tokenized = list(map(str.split, queries))
+        lengths = np.fromiter(map(len, tokenized), dtype=np.int64, count=len(tokenized))
+        num_tokens = int(lengths.sum())
+        ids = np.full((len(tokenized), max(lengths.max(initial=0), 1)), -1, dtype=np.int64)
+        rows = np.repeat(np.arange(len(tokenized)), lengths)
+        columns = np.arange(num_tokens) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        ids[rows, columns] = np.fromiter(
+            (get_id(token, -1) for tokens in tokenized for token in tokens),
+            dtype=np.int64, count=num_tokens)
+        return ids, lengths
+
+    def get_bigram_counts(self, id_1, id_2):
+        """Gathers the counts of the bigrams (id_1[i], id_2[i]) for every i."""
+        if len(self.bigram_keys) == 0:
+            return np.zeros(id_1.shape)
+        keys = id_1 * self.num_words + id_2
+        positions = np.searchsorted(self.bigram_keys, keys)
+        positions = np.minimum(positions, len(self.bigram_keys) - 1)
+        found = (id_1 >= 0) & (id_2 >= 0) & (self.bigram_keys[positions] == keys)
+        return np.where(found, self.bigram_counts[positions], 0.)
+
+    def get_query_logps(self, queries):
+        """Computes `LanguageModel.get_query_logp` of every query in `queries`.
+
+        Returns:
+            log_ps (np.ndarray): Log-probability of each query; NaN for
+                queries without terms, and -inf for queries with a term that
+                is not in the vocabulary (for which `get_query_logp` fails).
+        """
+        ids, lengths = self.encode(queries)
+        total = self.total_num_tokens
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_ps = np.log(self.unigram_counts[ids[:, 0]] / total)
+
+            id_1, id_2 = ids[:, :-1], ids[:, 1:]
+            prob_1 = self.unigram_counts[id_2] / total
+            prob_2 = self.get_bigram_counts(id_1, id_2) / self.unigram_counts[id_1]
+            bigram_logps = np.log(self.lambda_ * prob_1 + (1 - self.lambda_) * prob_2)
+        is_bigram = np.arange(1, ids.shape[1]) < lengths[:, None]
+        log_ps = log_ps + np.where(is_bigram, bigram_logps, 0.).sum(axis=1)
+
+        log_ps[~np.isfinite(log_ps)] = -np.inf
+        log_ps[lengths == 0] = np.nan
+        return log_ps
+
+
+def get_scores(lm_arrays, queries, log_edit_probs, mu):
+    """Computes `CandidateScorer.get_score` of every candidate query at once.
+
+    Args:
+        lm_arrays (LanguageModelArrays): Counts of the language model.
+        queries (list of str): Candidate queries.
+        log_edit_probs (list of float): Edit log-probability of each candidate.
+        mu (float): Weighting factor for the language model.
+
+    Returns:
+        scores (np.ndarray): Final score of each candidate. Candidates without
+            terms are scored by their edit log-probability alone.
+    """
+    log_edit_probs = np.asarray(log_edit_probs, dtype=np.float64)
+    if len(queries) == 0:
+        return log_edit_probs
+    query_logps = lm_arrays.get_query_logps(queries)
+    return log_edit_probs + mu * np.nan_to_num(query_logps, nan=0., neginf=-np.inf)
@@ -0,0 +1,213 @@
+
+
+BENCHMARK_ALPHABET = 'abcdefghijklmnopqrstuvwxyz0123456789 ,.-\''
+
+
+def apply_random_edit(term, rng, alphabet=BENCHMARK_ALPHABET):
+    """Applies one random insertion, deletion, substitution or transposition
+    to `term`."""
+    i = rng.randrange(len(term) + 1)
+    edit_type = rng.randrange(4)
+    if edit_type == 0 and len(term) > 1:
+        i = min(i, len(term) - 1)
+        return term[:i] + term[i + 1:]
+    if edit_type == 1:
+        return term[:i] + rng.choice(alphabet) + term[i:]
+    if edit_type == 2 and len(term) > 1:
+        i = min(i, len(term) - 2)
+        return term[:i] + term[i + 1] + term[i] + term[i + 2:]
+    i = min(i, len(term) - 1)
+    return term[:i] + rng.choice(alphabet) + term[i + 1:]
+
+
+def write_synthetic_data(out_dir, num_words=3000, num_files=8, tokens_per_file=20000,
+                         num_edit_pairs=20000, seed=0):
+    """Writes a random corpus and a training set of edit pairs in the layout of
+    the pa2-data directory, so that benchmarks do not depend on the real data.
+
+    Returns:
+        paths (tuple): Tuple (corpus_dir, training_set_path).
+    """
+    rng = random.Random(seed)
+    letters = BENCHMARK_ALPHABET[:26]
+    words = sorted({''.join(rng.choice(letters) for _ in range(rng.randint(1, 9)))
+                    for _ in range(num_words)})
+
+    corpus_dir = os.path.join(out_dir, 'corpus')
+    os.makedirs(corpus_dir, exist_ok=True)
+    for i in range(num_files):
+        with open(os.path.join(corpus_dir, 'doc{}.txt'.format(i)), 'w') as f:
+            f.write(' '.join(rng.choice(words) for _ in range(tokens_per_file)))
+
+    # Edit pairs over whole queries, plus random strings so that every
+    # character (and character bigram) of the alphabet is seen in training
+    training_set_path = os.path.join(out_dir, 'edit1s.txt')
+    chars = BENCHMARK_ALPHABET.replace(' ', '') + '$'
+    with open(training_set_path, 'w') as f:
+        for _ in range(num_edit_pairs):
+            original = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+            edited = apply_random_edit(original, rng) if rng.random() < .9 else original
+            if edited.strip() == edited and edited:
+                f.write('{}\t{}\n'.format(edited, original))
+        for _ in range(num_edit_pairs // 2):
+            original = ''.join(rng.choice(chars) for _ in range(12))
+            edited = apply_random_edit(original, rng).strip() or original
+            f.write('{}\t{}\n'.format(edited, original))
+    return corpus_dir, training_set_path
+
+
+def make_benchmark_queries(lm, num_queries=200, max_query_len=5, edit_rate=.5, seed=0):
+    """Samples queries of 1 to `max_query_len` in-vocabulary words, each word
+    misspelled by one random edit with probability `edit_rate`.
+
+    Returns:
+        queries (list of str): Raw queries, evenly spread over the lengths.
+    """
+    rng = random.Random(seed)
+    vocab = sorted(lm.unigram_counts)
+    queries = []
+    for i in range(num_queries):
+        words = [rng.choice(vocab) for _ in range(i % max_query_len + 1)]
+        words = [apply_random_edit(word, rng, BENCHMARK_ALPHABET[:26]) if rng.random() < edit_rate
+                 else word for word in words]
+        queries.append(' '.join(words))
+    return queries
+
+
+def get_peak_rss_mb():
+    """Gets the peak resident set size of this process so far, in MB, or None
+    where the `resource` module is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+def time_call(fn, *args, **kwargs):
+    """Calls `fn` and returns a tuple (result, elapsed seconds)."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_benchmark(corpus_dir=None, training_set_path=None, out_path='benchmark.json',
+                  num_queries=200, max_query_len=5, seed=0, workers=1):
+    """Benchmarks the correction pipeline end to end and writes the results to
+    `out_path` as JSON, so that runs can be compared across changes with
+    `compare_benchmarks`.
+
+    Measures model build times, snapshot save/load times, `get_candidates`
+    time and candidate count per query length, `correct_spelling` latency
+    percentiles and throughput for each edit probability model, and the peak
+    RSS after each stage.
+
+    Args:
+        corpus_dir (str): Corpus to build the language model from. A synthetic
+            corpus and training set are generated if it is None.
+        training_set_path (str): Training set for the empirical edit model.
+        out_path (str): Path to write the JSON results to.
+        num_queries (int): Number of benchmark queries.
+        max_query_len (int): Longest benchmark query, in words.
+        seed (int): Seed for the synthetic data and the queries.
+        workers (int): Number of processes for the batch throughput run.
+
+    Returns:
+        results (dict): The results written to `out_path`.
+    """
+    work_dir = tempfile.mkdtemp(prefix='spelling-benchmark-')
+    try:
+        if corpus_dir is None:
+            corpus_dir, training_set_path = write_synthetic_data(work_dir, seed=seed)
+        results = {'config': {'corpus_dir': corpus_dir, 'training_set_path': training_set_path,
+                              'num_queries': num_queries, 'max_query_len': max_query_len,
+                              'seed': seed, 'workers': workers},
+                   'environment': {'python': sys.version.split()[0],
+                                   'platform': platform.platform(),
+                                   'cpu_count': os.cpu_count(),
+                                   'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                   'build_s': {}, 'snapshot_s': {}, 'peak_rss_mb': {}}
+
+        lm, results['build_s']['language_model'] = time_call(LanguageModel, corpus_dir)
+        results['peak_rss_mb']['language_model'] = get_peak_rss_mb()
+        epms = {'uniform': UniformEditProbabilityModel()}
+        epms['empirical'], results['build_s']['empirical_edit_model'] = time_call(
+            EmpiricalEditProbabilityModel, training_set_path)
+        results['peak_rss_mb']['edit_models'] = get_peak_rss_mb()
+
+        lm_path = os.path.join(work_dir, 'lm.snap')
+        epm_path = os.path.join(work_dir, 'epm.snap')
+        _, results['snapshot_s']['save_language_model'] = time_call(save_language_model, lm, lm_path)
+        _, results['snapshot_s']['load_language_model'] = time_call(load_language_model, lm_path)
+        _, results['snapshot_s']['save_edit_model'] = time_call(save_edit_model, epms['empirical'],
+                                                                epm_path)
+        _, results['snapshot_s']['load_edit_model'] = time_call(load_edit_model, epm_path)
+        results['peak_rss_mb']['snapshots'] = get_peak_rss_mb()
+
+        queries = make_benchmark_queries(lm, num_queries, max_query_len, seed=seed)
+        for name, epm in epms.items():
+            cg = CandidateGenerator(lm, epm)
+            cs = CandidateScorer(lm, cg)
+
+            by_length = {}
+            for query in queries:
+                candidates, elapsed = time_call(lambda: list(cg.get_candidates(query)))
+                stats = by_length.setdefault(len(query.split()), {'ms': [], 'candidates': []})
+                stats['ms'].append(elapsed * 1000.)
+                stats['candidates'].append(len(candidates))
+            results[name] = {'get_candidates': {
+                length: {'queries': len(stats['ms']),
+                         'mean_ms': sum(stats['ms']) / len(stats['ms']),
+                         'mean_candidates': sum(stats['candidates']) / len(stats['candidates'])}
+                for length, stats in sorted(by_length.items())}}
+
+            latencies_ms = []
+            for query in queries:
+                _, elapsed = time_call(cs.correct_spelling, query)
+                latencies_ms.append(elapsed * 1000.)
+            results[name]['correct_spelling_ms'] = get_percentiles(latencies_ms)
+            results[name]['correct_spelling_ms']['mean'] = sum(latencies_ms) / len(latencies_ms)
+
+            cs.correct_spelling_batch(queries, workers=workers)
+            results[name]['throughput'] = cs.last_batch_stats
+            results['peak_rss_mb'][name] = get_peak_rss_mb()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(out_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Wrote benchmark results to {}'.format(out_path))
+    return results
+
+
+def compare_benchmarks(baseline_path, current_path, tolerance=.1):
+    """Compares two `run_benchmark` result files and prints every timing that
+    got more than `tolerance` (as a fraction) slower.
+
+    Returns:
+        regressions (list): Tuples (metric, baseline, current) of the timings
+            that regressed.
+    """
+    def get_timings(results, prefix='', is_timing=False):
+        for key, value in results.items():
+            name = prefix + str(key)
+            key_is_timing = is_timing or str(key).endswith(('_s', '_ms', 'seconds'))
+            if isinstance(value, dict):
+                yield from get_timings(value, name + '.', key_is_timing)
+            elif key_is_timing and isinstance(value, (int, float)):
+                yield name, value
+
+    with open(baseline_path) as f:
+        baseline = dict(get_timings(json.load(f)))
+    with open(current_path) as f:
+        current = dict(get_timings(json.load(f)))
+
+    regressions = []
+    for name, value in sorted(current.items()):
+        if baseline.get(name) and value > baseline[name] * (1 + tolerance):
+            regressions.append((name, baseline[name], value))
+            print('{}: {:.4g} -> {:.4g} ({:+.0%})'.format(name, baseline[name], value,
+                                                         value / baseline[name] - 1))
+    if not regressions:
+        print('No regressions beyond {:.0%}'.format(tolerance))
+    return regressions
@@ -7,14 +7,36 @@ class CandidateGenerator:
                 '0', '1', '2', '3', '4', '5', '6', '7', '8', '9',
                 ' ', ',', '.', '-', '\'']
 
-    def __init__(self, lm, epm):
+    def __init__(self, lm, epm, index=None, max_distance=1, term_cache_size=0, segmenter=None):
         """
         Args:
             lm (LanguageModel): Language model to use for prior probabilities, P(Q).
             epm (EditProbabilityModel): Edit probability model to use for P(R|Q).
+            index (SymmetricDeleteIndex or VocabularyTrie): Optional vocabulary
+                index over `lm`. When given, term candidates are looked up in the
+                index instead of enumerating every string within one edit of
+                the term.
+            max_distance (int): Largest edit distance of term candidates looked
+                up in `index` (1 or 2). Ignored when `index` is None.
+            term_cache_size (int): Number of terms whose candidates are kept in
+                an LRU cache. 0 disables the cache.
+            segmenter (WordSegmenter): Optional word segmenter. When given, the
+                best re-segmentations of the whole query that insert or delete
+                several spaces (e.g. "newyorktimes" -> "new york times") are
+                candidates too.
         """
         self.lm = lm
         self.epm = epm
+        self.index = index
+        self.max_distance = max_distance
+        self.term_cache = LRUCache(term_cache_size) if term_cache_size else None
+        self.segmenter = segmenter
+
+    def get_model_state(self):
+        """Gets a value that changes whenever the candidates generated for a
+        term may change, i.e. when a model is replaced or bumps its version."""
+        return (id(self.lm), self.lm.version, id(self.epm), self.epm.version,
+                id(self.index), self.max_distance, id(self.segmenter))
 
     def get_num_oov(self, query):
         """Get the number of out-of-vocabulary (OOV) words in `query`."""
@@ -49,165 +71,208 @@ class CandidateGenerator:
         # yield from self.filter_and_yield(query, self.epm.get_edit_logp(query, query))
 
         ### Begin your code    
+        query_tkns = query.split()
+        for edit_logp, spans in self.get_candidate_edits(query):
+            yield (self.build_candidate(query_tkns, spans) if spans else query), edit_logp
 
+    def get_candidate_edits(self, query, prune=None, cheapest_first=False, deadline=None):
+        """Same as `get_candidates`, but describes each candidate by where it
+        differs from `query` instead of building its string, so that it can be
+        scored without re-scoring the unedited terms (see `QueryDeltaScorer`)
+        and discarded before it is built.
+
+        Args:
+            query (str): Starting query.
+            prune (callable): Optional function prune(edit_logp, spans) that
+                returns True for a candidate that is not worth generating. The
+                candidates for a term are generated in order of decreasing edit
+                log-probability, so once prune returns True for a candidate,
+                the rest of its term's candidates (same span positions, lower
+                edit log-probability) are skipped too, except for single-term
+                edits, which may still lead to second-round edits.
+            cheapest_first (bool): Whether to yield the same candidates in
+                order of how cheap they are to find, for anytime search: the
+                unedited query, single edits of the OOV terms, single edits of
+                the other terms, merges, second edits, then re-segmentations.
+                By default, the second edits of each candidate directly follow
+                it.
+            deadline (float): Optional `time.perf_counter()` time at which to
+                stop generating. The clock is checked before each single edit,
+                merge, and the second edits of each, so the generator stops
+                soon after the deadline even when no candidate is in vocabulary.
+
+        Yields:
+            Tuples (cdt_edit_logp, spans), where spans is a sorted tuple of
+                non-overlapping (start, end, words) tuples, each replacing the
+                query terms `start:end` with the tuple of terms `words`.
+        """
         # split the query on spaces
         query_tkns = query.split()
-        candidates = []
-        i = 0
-        one_edit_candidate_queries = set()
-        while i < len(query_tkns):
-            candidate_query = query.split()
-            all_candidates = self.get_candidates_for_term(query_tkns[i])
-
-            for edited, edit_p in all_candidates:
-                candidate_query[i] = edited
-                candidate = " ".join(candidate_query)
-                one_edit_candidate_queries.add(candidate)
-
-                k = 0
-                total_query_editp = 0
-                while k < len(query_tkns):
-                    if i == k:
-                        total_query_editp = total_query_editp + edit_p
+        oov_positions = [j for j, tkn in enumerate(query_tkns) if self.get_num_oov(tkn) != 0]
+
+        # Log-probability of leaving every term unedited, so that the edit
+        # log-probability of a candidate only needs to adjust its edited terms
+        no_edit_logps = [self.epm.get_edit_logp(tkn, tkn) for tkn in query_tkns]
+        total_no_edit_logp = sum(no_edit_logps)
+
+        # Candidates of each term, best first. Second-round edits look up the
+        # same few terms once per first-round candidate.
+        term_candidates = {}
+
+        def get_sorted_candidates(term):
+            if term not in term_candidates:
+                term_candidates[term] = sorted(self.get_candidates_for_term(term),
+                                               key=lambda candidate: -candidate[1])
+            return term_candidates[term]
+
+        def get_second_edits(i, edited, edited_span, edit_p):
+            # Correct the first remaining spelling mistake in the candidate
+            mistake = next((j for j in oov_positions if j != i), -1)
+            if self.get_num_oov(edited) != 0 and (mistake == -1 or i < mistake):
+                mistake = i
+            if mistake != -1:
+                for edited_2, edit_p_2 in get_sorted_candidates(edited if mistake == i
+                                                                else query_tkns[mistake]):
+                    mistake_span = (mistake, mistake + 1, tuple(edited_2.split()))
+                    spans = ((mistake_span,) if mistake == i
+                             else tuple(sorted((edited_span, mistake_span))))
+                    edit_logp = total_no_edit_logp - no_edit_logps[mistake] + edit_p + edit_p_2
+                    if prune is not None and prune(edit_logp, spans):
+                        break
+                    if self.is_in_vocab(oov_positions, spans):
+                        yield edit_logp, spans
+
+        def get_merge_second_edits(i, newTerm, merged_span, original_word):
+            # Correct spelling mistake in candidate with accidental space above,
+            # in terms of the positions of the merged candidate.
+            mistake = next((j if j < i - 1 else j - 1 for j in oov_positions
+                            if j < i - 1 or j > i), -1)
+            if self.get_num_oov(newTerm) != 0 and (mistake == -1 or i - 1 < mistake):
+                mistake = i - 1
+            if mistake != -1:
+                mistake_term = newTerm if mistake == i - 1 else query_tkns[mistake + (mistake > i - 1)]
+                try:
+                    merge_logp = self.epm.get_edit_logp(newTerm, original_word)
+                except ValueError:
+                    # The edit model gives this merge (e.g. "123fox") a probability of 0
+                    return
+                merged_edit_logp = (total_no_edit_logp - no_edit_logps[i-1] - no_edit_logps[i]
+                                    + merge_logp)
+                for edited_2, edit_p_2 in get_sorted_candidates(mistake_term):
+                    edited_words = tuple(edited_2.split())
+                    if mistake == i - 1:
+                        spans = ((i - 1, i + 1, edited_words),)
+                        edit_logp = merged_edit_logp + edit_p_2
                     else:
-                        total_query_editp = total_query_editp + self.epm.get_edit_logp(query_tkns[k],query_tkns[k])
-                    k = k+1
-                
-                candidates.append((candidate,total_query_editp))
-                
-                j = 0
-                mistake = -1 
-                while j < len(candidate_query):
-                    word = candidate_query[j]
-                    if self.get_num_oov(word) != 0:
-                        mistake = j
+                        j = mistake if mistake < i - 1 else mistake + 1
+                        spans = tuple(sorted((merged_span, (j, j + 1, edited_words))))
+                        edit_logp = merged_edit_logp - no_edit_logps[j] + edit_p_2
+                    if prune is not None and prune(edit_logp, spans):
                         break
-                    j += 1
-                
-                if mistake != -1:
-                    j = mistake
-                    cand_query_2 = candidate_query[:]
-                    all_candidates_2 = self.get_candidates_for_term(candidate_query[j])   
-                    #all_candidates_2 = set(list(all_candidates_2)[:3])
-                    for edited_2, edit_p_2 in all_candidates_2:
-                        cand_query_2[j] = edited_2
-                        cand_2 = " ".join(cand_query_2)
-                        k = 0
-                        total_query_editp = 0
-                        while k < len(query_tkns):
-                            if j == k:
-                                total_query_editp = total_query_editp + edit_p + edit_p_2
-                            else:
-                                total_query_editp = total_query_editp + self.epm.get_edit_logp(query_tkns[k],query_tkns[k])
-                            k = k+1
-                            
-                        one_edit_candidate_queries.add(candidate)
-                        candidates.append((cand_2,total_query_editp))
-                    #cand_query_2 = candidate_query[:]
-                    
-                candidate_query = query.split()
-            i+=1
-        
+                    if self.is_in_vocab(oov_positions, spans):
+                        yield edit_logp, spans
+
+        # Second edits to generate after the merges, when cheapest first
+        deferred = []
+
+        def is_past_deadline():
+            return deadline is not None and time.perf_counter() >= deadline
+
+        if cheapest_first and not oov_positions:
+            yield self.epm.get_edit_logp(query, query), ()
+
+        positions = range(len(query_tkns))
+        if cheapest_first:
+            positions = oov_positions + [i for i in positions if i not in oov_positions]
+        for i in positions:
+            for edited, edit_p in get_sorted_candidates(query_tkns[i]):
+                if is_past_deadline():
+                    return
+                edited_span = (i, i + 1, tuple(edited.split()))
+                edit_logp = total_no_edit_logp - no_edit_logps[i] + edit_p
+                if prune is None or not prune(edit_logp, (edited_span,)):
+                    if self.is_in_vocab(oov_positions, (edited_span,)):
+                        yield edit_logp, (edited_span,)
+                if cheapest_first:
+                    deferred.append(get_second_edits(i, edited, edited_span, edit_p))
+                else:
+                    yield from get_second_edits(i, edited, edited_span, edit_p)
+
         #Remove white spaces at different places in string
-        if len(query_tkns) > 1:
-            i = 1
-            while i < len(query_tkns):
-                # Combine previous term and current term
-                newTerm = query_tkns[i-1] + query_tkns[i]
-                candidate = query_tkns[0:i-1] + [newTerm] + query_tkns[i+1:]
-                candidate = " ".join(candidate)
-                
-                if self.get_num_oov(candidate) == 0: 
-                    candidate_tkns = candidate.split()
-                    k = 0
-                    total_query_editp = 0
-                    while k < len(query_tkns):
-                        if k != len(query_tkns)-1 and candidate_tkns[k] == query_tkns[k] + query_tkns[k+1]:
-                            # joined k, k+1
-                            merged_word = candidate_tkns[k]
-                            original_word = query_tkns[k] + " " + query_tkns[k+1]
-                            total_query_editp = total_query_editp + self.epm.get_edit_logp(merged_word, original_word)
-                            k = k+1
-                        else:
-                            total_query_editp = total_query_editp + self.epm.get_edit_logp(query_tkns[k],query_tkns[k])
-                        k = k+1
-                    candidates.append((candidate,total_query_editp))
-                    
-                candidate_query = candidate.split()
-                
-                # Correct spelling mistake in candidate with accidental space above
-                j = 0
-                mistake = -1 
-                while j < len(candidate_query):
-                    word = candidate_query[j]
-                    if self.get_num_oov(word) != 0:
-                        mistake = j
-                        break
-                    j += 1
-                
-                if mistake != -1:
-                    j = mistake
-                    cand_query_2 = candidate_query[:]
-                    all_candidates_2 = self.get_candidates_for_term(candidate_query[j])   
-                    #all_candidates_2 = set(list(all_candidates_2)[:3])
-                    for edited_2, edit_p_2 in all_candidates_2:
-                        cand_query_2[j] = edited_2
-                        cand_2 = " ".join(cand_query_2)
-                        k = 0
-                        total_query_editp = 0
-                        while k < len(query_tkns):
-                            if j == k:
-                                total_query_editp = total_query_editp + edit_p + edit_p_2
-                            else:
-                                total_query_editp = total_query_editp + self.epm.get_edit_logp(query_tkns[k],query_tkns[k])
-                            k = k+1
-                            
-                        one_edit_candidate_queries.add(candidate)
-                        candidates.append((cand_2,total_query_editp))
-                
-                i += 1
-        
-        #Remove white spaces at different places in string from one_edit_candidates
-        
-        """for one_one_edit_candidate_query in one_edit_candidate_queries:
-            if len(one_one_edit_candidate_query) > 1:
-                query_tkns_one_edit = one_one_edit_candidate_query.split()
-                accidental_splits = self.get_accidental_splits(query_tkns_one_edit)
-            
-                for accidental_split in accidental_splits:
-                    accidental_split_tkns = accidental_split.split()
-                    k = 0
-                    total_query_editp = 0
-                    while k < len(query_tkns):
-                        if k != len(query_tkns)-1 and accidental_split_tkns[k] == query_tkns[k] + query_tkns[k+1]:
-                        # joined k, k+1
-                            merged_word = accidental_split_tkns[k]
-                            original_word = query_tkns[k] + " " + query_tkns[k+1]
-                            total_query_editp = total_query_editp + self.epm.get_edit_logp(merged_word, original_word)
-                            k = k+1
-                        else:
-                            total_query_editp = total_query_editp + self.epm.get_edit_logp(query_tkns[k],query_tkns[k])
-                        k = k+1                
-                    candidates.append((candidate,total_query_editp))
-        """
-        ### Insert hyphens - at different places in string
-        ###################################################
-        
-                   
-        ###################################################
-        final_candidates = []
-        for cd, lp_cd in candidates:
-            if self.get_num_oov(cd) == 0:
-                final_candidates.append((cd, lp_cd))
-            #yield from self.filter_and_yild(cd,lp_cd)
-        
+        for i in range(1, len(query_tkns)):
+            if is_past_deadline():
+                return
+            # Combine previous term and current term
+            newTerm = query_tkns[i-1] + query_tkns[i]
+            merged_span = (i - 1, i + 1, (newTerm,))
+            original_word = query_tkns[i-1] + " " + query_tkns[i]
+            # Only merges into vocabulary words are scored: the edit model
+            # may give others (e.g. "123fox") a probability of 0
+            if self.is_in_vocab(oov_positions, (merged_span,)):
+                edit_logp = (total_no_edit_logp - no_edit_logps[i-1] - no_edit_logps[i]
+                             + self.epm.get_edit_logp(newTerm, original_word))
+                if prune is None or not prune(edit_logp, (merged_span,)):
+                    yield edit_logp, (merged_span,)
+            if cheapest_first:
+                deferred.append(get_merge_second_edits(i, newTerm, merged_span, original_word))
+            else:
+                yield from get_merge_second_edits(i, newTerm, merged_span, original_word)
+
+        for second_edits in deferred:
+            if is_past_deadline():
+                return
+            yield from second_edits
+
+        # Re-segmentations of the whole query with several spaces inserted or
+        # deleted; the spans replace the unedited terms they cover
+        if self.segmenter is not None:
+            for space_edit_logp, spans in self.segmenter.get_segmentation_edits(query_tkns):
+                edit_logp = total_no_edit_logp + space_edit_logp - sum(
+                    sum(no_edit_logps[start:end]) for start, end, _ in spans)
+                if prune is None or not prune(edit_logp, spans):
+                    if self.is_in_vocab(oov_positions, spans):
+                        yield edit_logp, spans
+
         # Yield original query
-        if self.get_num_oov(query) == 0:
-            final_candidates.append((query, self.epm.get_edit_logp(query, query)))
-        
-        return final_candidates
-            
+        if not cheapest_first and not oov_positions:
+            yield self.epm.get_edit_logp(query, query), ()
+
+    def is_in_vocab(self, oov_positions, spans):
+        """Checks whether the query with `spans` applied has no OOV terms, i.e.
+        whether the spans replace every OOV term of the query, and only with
+        in-vocabulary terms."""
+        covered = 0
+        for start, end, words in spans:
+            if any(word not in self.lm.unigram_counts for word in words):
+                return False
+            covered += sum(1 for j in oov_positions if start <= j < end)
+        return covered == len(oov_positions)
+
+    def build_candidate(self, query_tkns, spans):
+        """Builds the candidate string for `query_tkns` with `spans` applied."""
+        tokens = []
+        pos = 0
+        for start, end, words in spans:
+            tokens += query_tkns[pos:start]
+            tokens += words
+            pos = end
+        tokens += query_tkns[pos:]
+        return " ".join(tokens)
+
     def get_candidates_for_term(self, term):
+        """Gets the set of (candidate, edit_logp) pairs for a single term,
+        from `self.term_cache` when enabled."""
+        if self.term_cache is None:
+            return self.compute_candidates_for_term(term)
+
+        self.term_cache.validate(self.get_model_state())
+        candidates = self.term_cache.get(term)
+        if candidates is None:
+            candidates = frozenset(self.compute_candidates_for_term(term))
+            self.term_cache.put(term, candidates)
+        return candidates
+
+    def compute_candidates_for_term(self, term):
         all_candidates = set()
         candidates_with_one_edit_distance = set(); candidates_with_two_edit_distance = set()
 
@@ -215,18 +280,84 @@ class CandidateGenerator:
             all_candidates.add((term, self.epm.get_edit_logp(term,term)))
             return all_candidates
         
+        if self.index is not None:
+            return self.get_indexed_candidates_for_term(term)
+
         if self.get_num_oov(term) == 0:
             all_candidates.add((term, self.epm.get_edit_logp(term,term)))
         
-        one_edit_tokens = self.get_one_edit_tokens(term)
-        for one_edit_token in one_edit_tokens:
-            if self.get_num_oov(one_edit_token) == 0:
-                candidates_with_one_edit_distance.add((one_edit_token.strip(), self.epm.get_edit_logp(one_edit_token,term)))
+        one_edit_tokens = [one_edit_token for one_edit_token in self.get_one_edit_tokens(term)
+                           if self.get_num_oov(one_edit_token) == 0]
+        edit_logps = self.epm.get_edit_logp_batch(one_edit_tokens, term)
+        for one_edit_token, edit_logp in zip(one_edit_tokens, edit_logps):
+            candidates_with_one_edit_distance.add((one_edit_token.strip(), edit_logp))
         
         #candidates_with_two_edit_distance = candidates_with_two_edit_distance|candidates_with_one_edit_distance
         all_candidates = all_candidates |candidates_with_one_edit_distance
         return all_candidates
         
+    def get_indexed_candidates_for_term(self, term):
+        """Same as `compute_candidates_for_term`, but looks up vocabulary words near
+        `term` in `self.index`. For distance 1 this returns exactly the pairs the
+        brute-force enumeration returns: only the few space insertions and
+        substitutions (which split a term into several words) are enumerated.
+        Distance-2 candidates are scored through an intermediate term, like
+        second-round edits in `get_candidates`.
+        """
+        all_candidates = set()
+        if self.get_num_oov(term) == 0:
+            all_candidates.add((term, self.epm.get_edit_logp(term, term)))
+
+        one_edit_tokens = []
+        for word, distance in self.index.lookup(term, self.max_distance):
+            if word == term:
+                continue
+            if distance == 1:
+                if self.is_one_edit_token(word, term):
+                    one_edit_tokens.append(word)
+            else:
+                intermediate = get_intermediate_term(word, term)
+                try:
+                    edit_logp = (self.epm.get_edit_logp(intermediate, term)
+                                 + self.epm.get_edit_logp(word, intermediate))
+                except ValueError:
+                    # The edit model gives one of the edits (e.g. inserting an
+                    # unseen "é") a probability of 0
+                    continue
+                all_candidates.add((word, edit_logp))
+
+        # Edits that insert or substitute a space, or delete the whole term
+        space_edits = [term[:x] + ' ' + term[x:] for x in range(len(term) + 1)]
+        space_edits += [term[:x] + ' ' + term[x + 1:] for x in range(len(term))]
+        if len(term) == 1:
+            space_edits.append('')
+        one_edit_tokens += [edited for edited in space_edits if self.get_num_oov(edited) == 0]
+
+        edit_logps = self.epm.get_edit_logp_batch(one_edit_tokens, term)
+        for one_edit_token, edit_logp in zip(one_edit_tokens, edit_logps):
+            all_candidates.add((one_edit_token.strip(), edit_logp))
+        return all_candidates
+
+    def is_one_edit_token(self, edited, token):
+        """Checks whether `get_one_edit_tokens(token)` would generate `edited`,
+        i.e. whether `edited` is one edit from `token` and any inserted or
+        substituted character is in `self.alphabet`.
+        """
+        p = 0
+        while p < min(len(edited), len(token)) and edited[p] == token[p]:
+            p += 1
+
+        if len(edited) == len(token) - 1:
+            return edited[p:] == token[p + 1:]
+        if len(edited) == len(token) + 1:
+            return edited[p] in self.alphabet and edited[p + 1:] == token[p:]
+        if len(edited) != len(token) or p == len(token):
+            return False
+        if edited[p + 1:] == token[p + 1:]:
+            return edited[p] in self.alphabet
+        return (p + 1 < len(token) and edited[p] == token[p + 1]
+                and edited[p + 1] == token[p] and edited[p + 2:] == token[p + 2:])
+
     def get_one_edit_tokens(self, token):
         one_edit_tokens = set()
         # get accidental insertions by deleting each character. 
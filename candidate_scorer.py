@@ -1,28 +1,44 @@
 
 
+def get_default_mu(epm):
+    """Gets the language model weight tuned for the type of `epm`."""
+    if type(epm) is UniformEditProbabilityModel:
+        return 0.52
+    elif type(epm) is EmpiricalEditProbabilityModel:
+        return 0.75
+    return 1.
+
+
 class CandidateScorer:
     """Combines the `LanguageModel`, `EditProbabilityModel`, and
     `CandidateGenerator` to produce the most likely query Q given a raw query R.
     Since the candidate generator already uses the edit probability model, we
     do not need to take the edit probability model as an argument in the constructor.
     """
-    def __init__(self, lm, cg, mu=1.):
+    def __init__(self, lm, cg, mu=None, query_cache_size=0, decoding='exhaustive'):
         """
         Args:
             lm (LanguageModel): Language model for estimating P(Q).
             cg (CandidateGenerator): Candidate generator for generating possible Q.
             mu (float): Weighting factor for the language model (see write-up).
                 Remember that our probability computations are done in log-space.
+                Defaults to the value tuned for the type of `cg.epm` (1 for
+                other edit models).
+            query_cache_size (int): Number of raw queries whose corrections are
+                kept in an LRU cache. 0 disables the cache.
+            decoding (str): 'exhaustive' scores every candidate query from
+                `cg.get_candidates`; 'lattice' runs Viterbi over a lattice of
+                per-term candidates with `LatticeDecoder`, which also considers
+                queries with more than two edited terms; 'vectorized' scores
+                every candidate query like 'exhaustive', but all at once with
+                NumPy over `LanguageModelArrays`.
         """
         self.lm = lm
         self.cg = cg
-        self.mu = mu
-        
-        if type(self.cg.epm) is UniformEditProbabilityModel:
-            self.mu = 0.52
-            print('Uniform - 0.52 !!!')
-        elif type(self.cg.epm) is EmpiricalEditProbabilityModel:
-            self.mu = 0.75
+        self.mu = mu if mu is not None else get_default_mu(cg.epm)
+        self.decoding = decoding
+        self.query_cache = LRUCache(query_cache_size) if query_cache_size else None
+        self.lm_arrays = None  # Built on first use by `get_lm_arrays`
 
     def get_score(self, query, log_edit_prob):
         """Uses the language model and `log_edit_prob` to compute the final
@@ -46,38 +62,219 @@ class CandidateScorer:
         return score
         ### End your code
 
-    def correct_spelling(self, r):
+    def get_lm_arrays(self):
+        """Gets the `LanguageModelArrays` of `self.lm`, rebuilt when the
+        language model has changed since they were built."""
+        if self.lm_arrays is None or self.lm_arrays.state != (id(self.lm), self.lm.version):
+            self.lm_arrays = LanguageModelArrays(self.lm)
+        return self.lm_arrays
+
+    def get_scores(self, queries, log_edit_probs):
+        """Same as `get_score` for every candidate in `queries` at once.
+
+        Returns:
+            scores (np.ndarray): Final score of each candidate query.
+        """
+        return get_scores(self.get_lm_arrays(), queries, log_edit_probs, self.mu)
+
+    def correct_spelling(self, r, deadline_ms=None):
         """Corrects spelling of raw query `r` to get the intended query `q`.
 
         Args:
             r (str): Raw input query from the user.
+            deadline_ms (float): Optional time budget in milliseconds. When
+                given, candidates are expanded cheapest first (see
+                `CandidateGenerator.get_candidate_edits`) with the exhaustive
+                search, whatever `self.decoding`, and the best correction
+                found so far is returned when the budget runs out.
 
         Returns:
             q (str): Spell-corrected query. That is, the query that maximizes
                 P(R|Q)*P(Q) under the language model and edit probability model,
                 restricted to Q's generated by the candidate generator.
+            completed (bool): Only returned when `deadline_ms` is given:
+                whether every candidate was considered before the deadline.
         """
         ### Begin your code
-        canditates_scores = []
-        total_candidates = 0
-        for candidate, candidate_logp in self.cg.get_candidates(r):
-            if candidate == ' ' or candidate == '  ' or candidate == '   ':
-                print(candidate, ' ',candidate_logp)
-                continue
-                
-            score = self.get_score(candidate,candidate_logp)
-            canditates_scores.append((candidate,score))
-            total_candidates +=1
-        
-        if len(canditates_scores) == 0:
+        deadline = None if deadline_ms is None else time.perf_counter() + deadline_ms / 1000.
+        # Hold the read lock so that an update of the language model (see
+        # `LanguageModel.add_documents`) is seen either entirely or not at all
+        with self.lm.lock.reading():
+            if self.query_cache is not None:
+                self.query_cache.validate((id(self.lm), self.lm.version, self.mu, self.decoding)
+                                          + self.cg.get_model_state())
+                result = self.query_cache.get(r)
+                if result is not None:
+                    return result if deadline is None else (result, True)
+
+            if deadline is None:
+                result, completed = self.compute_spelling_correction(r), True
+            else:
+                top_corrections, completed = self.search_topk(r, 1, deadline)
+                result = top_corrections[0][0] if top_corrections else r
+
+            # Corrections cut short by the deadline are not cached
+            if self.query_cache is not None and completed:
+                self.query_cache.put(r, result)
+            return result if deadline is None else (result, completed)
+        ### End your code
+
+    def compute_spelling_correction(self, r):
+        """Corrects spelling of raw query `r` without going through the cache."""
+        if self.decoding == 'lattice':
+            result = LatticeDecoder(self.lm, self.cg, self.mu).correct_spelling(r)
+            return r if result is None else result
+
+        if self.decoding == 'vectorized':
+            candidates = [(q, edit_logp) for q, edit_logp in self.cg.get_candidates(r) if q.strip()]
+            if not candidates:
+                return r
+            queries, edit_logps = zip(*candidates)
+            return ' '.join(queries[int(np.argmax(self.get_scores(queries, edit_logps)))].split())
+
+        top_corrections = self.compute_topk(r, 1)
+        if len(top_corrections) == 0:
             # Kick out from here !!
             return r
-        
-        # Else sort remaining results
-        canditates_scores = sorted(canditates_scores,key = lambda x: x[1], reverse = True)
-        result = canditates_scores[0][0]
-        result = " ".join(result.split())
-        return result
-        ### End your code
+        return top_corrections[0][0]
+
+    def correct_spelling_topk(self, r, k):
+        """Gets the `k` most likely intended queries for raw query `r`, e.g. for
+        "did you mean" suggestions.
+
+        Candidates are streamed from `self.cg.get_candidate_edits` and scored
+        incrementally against `r` (equivalent to `self.get_score`). Only the
+        best `k` are kept, in a heap, and a candidate is pruned before it is
+        scored or built when its edit log-probability plus an optimistic
+        bound on its language model score cannot beat the k-th best so far.
+        This search is exhaustive whatever `self.decoding`, so with 'lattice'
+        decoding its best correction may differ from `correct_spelling`'s.
+
+        Args:
+            r (str): Raw input query from the user.
+            k (int): Number of corrections to return.
+
+        Returns:
+            corrections (list): Up to `k` tuples (q, score), best first.
+        """
+        with self.lm.lock.reading():
+            return self.compute_topk(r, k)
+
+    def compute_topk(self, r, k):
+        """Same as `correct_spelling_topk`, without taking the read lock."""
+        return self.search_topk(r, k)[0]
+
+    def search_topk(self, r, k, deadline=None):
+        """Same as `compute_topk`, stopping at `deadline` if given.
+
+        Args:
+            r (str): Raw input query from the user.
+            k (int): Number of corrections to return.
+            deadline (float): Optional `time.perf_counter()` time at which to
+                stop. Candidates are then expanded cheapest first, so that the
+                best corrections found by the deadline are likely ones.
+
+        Returns:
+            corrections (list): Up to `k` tuples (q, score), best first.
+            completed (bool): Whether every candidate was considered.
+        """
+        query_tkns = r.split()
+        delta_scorer = self.get_delta_scorer(query_tkns)
+        best_scores = {}  # Maps candidates in the top k -> score
+        heap = []         # Min-heap of (score, -order, candidate) for `best_scores`
+
+        def prune(edit_logp, spans):
+            if len(best_scores) < k:
+                return False
+            upper_bound = edit_logp + self.mu * delta_scorer.get_query_logp_upper_bound(spans)
+            return upper_bound < heap[0][0]
+
+        candidate_edits = self.cg.get_candidate_edits(r, prune, cheapest_first=deadline is not None,
+                                                      deadline=deadline)
+        for order, (edit_logp, spans) in enumerate(candidate_edits):
+            query_logp = delta_scorer.get_query_logp(spans)
+            if query_logp is None:
+                continue  # Candidate with no terms left
+            score = edit_logp + self.mu * query_logp
+            if len(best_scores) >= k and score <= heap[0][0]:
+                continue
+
+            candidate = self.cg.build_candidate(query_tkns, spans)
+            if candidate in best_scores and score <= best_scores[candidate]:
+                continue
+            best_scores[candidate] = score
+            heapq.heappush(heap, (score, -order, candidate))
+            while len(best_scores) > k:
+                evicted_score, _, evicted = heapq.heappop(heap)
+                if best_scores.get(evicted) == evicted_score:
+                    del best_scores[evicted]
+            # Drop entries superseded by a better score for the same candidate
+            while heap and best_scores.get(heap[0][2]) != heap[0][0]:
+                heapq.heappop(heap)
+
+        # The generator stops without saying why, so a search that ends past
+        # the deadline counts as cut short
+        completed = deadline is None or time.perf_counter() < deadline
+        return sorted(best_scores.items(), key=lambda correction: -correction[1]), completed
+
+    def get_delta_scorer(self, query_tkns):
+        """Gets the `QueryDeltaScorer` of candidates for `query_tkns`."""
+        return QueryDeltaScorer(self.lm, query_tkns)
+
+    def get_cache_stats(self):
+        """Gets the counters of the query cache and the term cache, if enabled."""
+        return {'query_cache': self.query_cache and self.query_cache.get_stats(),
+                'term_cache': self.cg.term_cache and self.cg.term_cache.get_stats()}
+
+    def correct_spelling_batch(self, queries, workers=None, chunksize=64, scorer_factory=None):
+        """Corrects the spelling of every query in `queries`, spreading them
+        over a pool of `workers` processes. Each worker gets its own scorer once,
+        when it starts, rather than once per query.
+
+        Args:
+            queries (list of str): Raw input queries.
+            workers (int): Number of worker processes. Defaults to the number
+                of CPUs; 1 corrects every query in this process.
+            chunksize (int): Number of queries sent to a worker at a time.
+            scorer_factory (callable): Optional function returning the
+                `CandidateScorer` to use in each worker, e.g. one that loads
+                models from memory-mapped snapshots so that workers share their
+                pages. Defaults to a copy of this scorer.
+
+        Returns:
+            corrections (list of str): Spell-corrected queries, in the order of
+                `queries`. Throughput is saved in `self.last_batch_stats`.
+        """
+        start = time.perf_counter()
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            corrections = [self.correct_spelling(query) for query in queries]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_correction_worker,
+                                     initargs=(scorer_factory or self,)) as executor:
+                corrections = list(executor.map(correct_spelling_in_worker, queries,
+                                                chunksize=chunksize))
+        elapsed = time.perf_counter() - start
+
+        self.last_batch_stats = {'queries': len(corrections), 'workers': workers,
+                                 'seconds': elapsed,
+                                 'queries_per_second': len(corrections) / elapsed if elapsed else 0.}
+        return corrections
+
+
+worker_scorer = None  # `CandidateScorer` of the current worker process
+
+
+def init_correction_worker(scorer_or_factory):
+    """Sets up the scorer of a `correct_spelling_batch` worker process."""
+    global worker_scorer
+    if isinstance(scorer_or_factory, CandidateScorer):
+        worker_scorer = scorer_or_factory
+    else:
+        worker_scorer = scorer_or_factory()
+
+
+def correct_spelling_in_worker(query):
+    """Corrects `query` with the scorer of the current worker process."""
+    return worker_scorer.correct_spelling(query)
 
-   
@@ -0,0 +1,172 @@
+
+
+class CompactUnigramCounts(Mapping):
+    """Read-only, Counter-like view of unigram counts stored in a typed array
+    indexed by word id. Missing words have a count of 0."""
+
+    def __init__(self, word_ids, words, counts):
+        self.word_ids = word_ids  # Maps strings w_1 -> id(w_1)
+        self.words = words        # Maps id(w_1) -> w_1
+        self.counts = counts      # Maps id(w_1) -> count(w_1)
+
+    def __getitem__(self, word):
+        word_id = self.word_ids.get(word)
+        return 0 if word_id is None else self.counts[word_id]
+
+    def __contains__(self, word):
+        return word in self.word_ids
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __len__(self):
+        return len(self.words)
+
+
+class CompactBigramCounts(Mapping):
+    """Read-only, Counter-like view of bigram counts stored as a CSR adjacency
+    keyed by the id of w_1: the ids of all w_2 that follow w_1 are sorted in
+    `next_ids[offsets[id(w_1)]:offsets[id(w_1) + 1]]`, with their counts at the
+    same positions in `counts`. Missing bigrams have a count of 0."""
+
+    def __init__(self, word_ids, words, offsets, next_ids, counts):
+        self.word_ids = word_ids
+        self.words = words
+        self.offsets = offsets
+        self.next_ids = next_ids
+        self.counts = counts
+
+    def get_index(self, w_1, w_2):
+        """Gets the position of bigram (w_1, w_2) in the CSR arrays, or -1."""
+        id_1 = self.word_ids.get(w_1)
+        id_2 = self.word_ids.get(w_2)
+        if id_1 is None or id_2 is None:
+            return -1
+        lo, hi = self.offsets[id_1], self.offsets[id_1 + 1]
+        i = bisect.bisect_left(self.next_ids, id_2, lo, hi)
+        return i if i < hi and self.next_ids[i] == id_2 else -1
+
+    def __getitem__(self, bigram):
+        i = self.get_index(*bigram)
+        return 0 if i == -1 else self.counts[i]
+
+    def __contains__(self, bigram):
+        return self.get_index(*bigram) != -1
+
+    def __iter__(self):
+        for id_1 in range(len(self.words)):
+            for i in range(self.offsets[id_1], self.offsets[id_1 + 1]):
+                yield self.words[id_1], self.words[self.next_ids[i]]
+
+    def __len__(self):
+        return len(self.next_ids)
+
+
+class CompactLanguageModel(LanguageModel):
+    """`LanguageModel` that interns words to integer ids and keeps its counts in
+    typed arrays instead of Counters of strings and tuples. `unigram_counts` and
+    `bigram_counts` are read-only views over the arrays, so every
+    `LanguageModel` method works unchanged and returns the same results.
+    """
+
+    def __init__(self, corpus_dir='pa2-data/corpus', lambda_=0.05):
+        """Counts the corpus like `LanguageModel`, then compacts the counts.
+
+        Args:
+            corpus_dir (str): Path to directory containing corpus.
+            lambda_ (float): Interpolation factor for smoothing by unigram-bigram
+                interpolation.
+        """
+        super().__init__(corpus_dir, lambda_)
+        self.set_counts(self.unigram_counts, self.bigram_counts)
+
+    @classmethod
+    def from_language_model(cls, lm):
+        """Builds a `CompactLanguageModel` from the counts of an existing `lm`."""
+        compact_lm = cls.__new__(cls)
+        compact_lm.lambda_ = lm.lambda_
+        compact_lm.total_num_tokens = lm.total_num_tokens
+        compact_lm.set_counts(lm.unigram_counts, lm.bigram_counts)
+        return compact_lm
+
+    @classmethod
+    def from_corpus(cls, *args, **kwargs):
+        """Builds a `CompactLanguageModel` with `LanguageModel.from_corpus`."""
+        return cls.from_language_model(LanguageModel.from_corpus(*args, **kwargs))
+
+    def set_counts(self, unigram_counts, bigram_counts):
+        """Interns the words of `unigram_counts` in sorted order, and replaces
+        the count attributes with views over typed arrays."""
+        words = sorted(unigram_counts)
+        word_ids = {word: word_id for word_id, word in enumerate(words)}
+        unigram_array = array('q', (unigram_counts[word] for word in words))
+
+        bigrams = sorted((word_ids[w_1], word_ids[w_2], count)
+                         for (w_1, w_2), count in bigram_counts.items())
+        offsets = array('q', [0]) * (len(words) + 1)
+        for id_1, _, _ in bigrams:
+            offsets[id_1 + 1] += 1
+        for word_id in range(len(words)):
+            offsets[word_id + 1] += offsets[word_id]
+        next_ids = array('i', (id_2 for _, id_2, _ in bigrams))
+        bigram_array = array('q', (count for _, _, count in bigrams))
+
+        self.set_arrays(word_ids, words, unigram_array, offsets, next_ids, bigram_array)
+
+    def set_arrays(self, word_ids, words, unigram_array, offsets, next_ids, bigram_array):
+        """Points the count views at already-built arrays."""
+        self.word_ids = word_ids
+        self.words = words
+        self.unigram_counts = CompactUnigramCounts(word_ids, words, unigram_array)
+        self.bigram_counts = CompactBigramCounts(word_ids, words, offsets, next_ids,
+                                                 bigram_array)
+        self.version += 1
+
+    def apply_counts_delta(self, partial_counts, sign):
+        raise TypeError('CompactLanguageModel counts are read-only; update a LanguageModel '
+                        'and compact it again with `from_language_model`')
+
+
+def get_deep_size(*objs):
+    """Gets the number of bytes taken by `objs` and every container, key and
+    value reachable from them, counting shared objects once."""
+    seen = set()
+    size = 0
+    stack = list(objs)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return size
+
+
+def get_memory_footprint(lm):
+    """Gets the number of bytes taken by the count storage of `lm`."""
+    if isinstance(lm, CompactLanguageModel):
+        unigrams, bigrams = lm.unigram_counts, lm.bigram_counts
+        return get_deep_size(lm.word_ids, lm.words, unigrams.counts, bigrams.offsets,
+                             bigrams.next_ids, bigrams.counts)
+    return get_deep_size(lm.unigram_counts, lm.bigram_counts)
+
+
+def compare_memory_footprint(lm, compact_lm):
+    """Reports the memory taken by the Counter-based `lm` against the same
+    counts in `compact_lm`.
+
+    Returns:
+        footprint (dict): Bytes taken by each layout, and their ratio.
+    """
+    counter_bytes = get_memory_footprint(lm)
+    compact_bytes = get_memory_footprint(compact_lm)
+    print('Counter-based: {:,} bytes, compact: {:,} bytes ({:.1f}x smaller)'.format(
+        counter_bytes, compact_bytes, counter_bytes / compact_bytes))
+    return {'counter_bytes': counter_bytes,
+            'compact_bytes': compact_bytes,
+            'ratio': counter_bytes / compact_bytes}
@@ -0,0 +1,84 @@
+
+
+class CorrectionSession:
+    """Stateful, as-you-type spelling correction for a search box: call
+    `update` with the full text after every keystroke.
+
+    The session decodes with a `LatticeDecoder` and keeps its Viterbi columns
+    from one call to the next. Column k only depends on the first k tokens, so
+    when the text changes, only the columns after the longest unchanged token
+    prefix are recomputed: typing or editing the last token recomputes one or
+    two columns, whatever the length of the query. The arcs of recently seen
+    tokens are cached too, so that backspacing and retyping is cheap.
+    """
+
+    def __init__(self, cs, arc_cache_size=1024):
+        """
+        Args:
+            cs (CandidateScorer): Scorer whose models and `mu` to decode with.
+            arc_cache_size (int): Number of (previous token, token) pairs whose
+                lattice arcs are kept.
+        """
+        self.cs = cs
+        self.arc_cache = LRUCache(arc_cache_size)
+        self.reset()
+
+    def reset(self):
+        """Forgets the current text, and picks up the current models and `mu`
+        of the scorer."""
+        self.decoder = LatticeDecoder(self.cs.lm, self.cs.cg, self.cs.mu)
+        self.tokens = []
+        self.columns = [{LatticeDecoder.START: (0., None)}]
+        self.state = None
+        self.correction = ''
+
+    def get_model_state(self):
+        return ((id(self.cs.lm), self.cs.lm.version, self.cs.mu, id(self.cs.cg))
+                + self.cs.cg.get_model_state())
+
+    def get_arcs_into(self, end):
+        """Same as `LatticeDecoder.get_arcs_into` for the current tokens, from
+        the cache when possible. Arcs are cached with their start relative to
+        `end`, since the same tokens may come back at another position."""
+        key = (self.tokens[end - 2] if end > 1 else None, self.tokens[end - 1])
+        arcs = self.arc_cache.get(key)
+        if arcs is None:
+            arcs = [(end - start, words, edit_logp)
+                    for start, words, edit_logp in self.decoder.get_arcs_into(self.tokens, end)]
+            self.arc_cache.put(key, arcs)
+        return [(end - length, words, edit_logp) for length, words, edit_logp in arcs]
+
+    def update(self, text):
+        """Corrects the current text of the search box.
+
+        Args:
+            text (str): Full raw query typed so far.
+
+        Returns:
+            q (str): Spell-corrected query, or `text` itself if the lattice has
+                no complete path.
+        """
+        with self.cs.lm.lock.reading():
+            state = self.get_model_state()
+            if state != self.state:
+                self.reset()
+                self.state = state
+                self.arc_cache.validate(state)
+
+            tokens = text.split()
+            unchanged = 0
+            while (unchanged < min(len(tokens), len(self.tokens))
+                   and tokens[unchanged] == self.tokens[unchanged]):
+                unchanged += 1
+            if unchanged == len(tokens) == len(self.tokens):
+                return self.correction
+
+            # Column k depends on tokens[:k] only
+            self.tokens = tokens
+            del self.columns[unchanged + 1:]
+            for end in range(unchanged + 1, len(tokens) + 1):
+                self.columns.append(self.decoder.get_column(self.columns, self.get_arcs_into(end)))
+
+            path = self.decoder.get_best_path(self.columns) if tokens else None
+            self.correction = text if path is None else ' '.join(path[0])
+            return self.correction
@@ -0,0 +1,67 @@
+
+
+def get_osa_distance_matrix(original, edited):
+    """Builds the dynamic-programming table for the optimal string alignment
+    (restricted Damerau-Levenshtein) distance between `original` and `edited`.
+
+    Args:
+        original (str): Original term.
+        edited (str): Edited term.
+
+    Returns:
+        d (list of list of int): `d[i][j]` is the distance between
+            `original[:i]` and `edited[:j]`.
+    """
+    d = [[0] * (len(edited) + 1) for _ in range(len(original) + 1)]
+    for i in range(len(original) + 1):
+        d[i][0] = i
+    for j in range(len(edited) + 1):
+        d[0][j] = j
+
+    for i in range(1, len(original) + 1):
+        for j in range(1, len(edited) + 1):
+            cost = 0 if original[i - 1] == edited[j - 1] else 1
+            d[i][j] = min(d[i - 1][j] + 1,         # deletion
+                          d[i][j - 1] + 1,         # insertion
+                          d[i - 1][j - 1] + cost)  # substitution
+            if (i > 1 and j > 1 and original[i - 1] == edited[j - 2]
+                    and original[i - 2] == edited[j - 1]):
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)  # transposition
+    return d
+
+
+def get_osa_distance(original, edited):
+    """Gets the optimal string alignment distance between two terms."""
+    return get_osa_distance_matrix(original, edited)[-1][-1]
+
+
+def get_intermediate_term(edited, original):
+    """Gets a term that is one edit away from `original` and one edit closer
+    to `edited`, by undoing the last edit on an optimal alignment. Applying it
+    twice walks a distance-2 pair through the single edits that the edit
+    probability models know how to score.
+
+    Args:
+        edited (str): Edited term, at least one edit away from `original`.
+        original (str): Original term.
+
+    Returns:
+        intermediate (str): Term one edit away from `original`.
+    """
+    d = get_osa_distance_matrix(original, edited)
+    i, j = len(original), len(edited)
+    while i > 0 or j > 0:
+        if (i > 0 and j > 0 and original[i - 1] == edited[j - 1]
+                and d[i][j] == d[i - 1][j - 1]):
+            i, j = i - 1, j - 1
+            continue
+        if (i > 1 and j > 1 and original[i - 1] == edited[j - 2]
+                and original[i - 2] == edited[j - 1]
+                and d[i][j] == d[i - 2][j - 2] + 1):
+            return original[:i - 2] + original[i - 1] + original[i - 2] + original[i:]
+        if i > 0 and j > 0 and d[i][j] == d[i - 1][j - 1] + 1:
+            return original[:i - 1] + edited[j - 1] + original[i:]
+        if i > 0 and d[i][j] == d[i - 1][j] + 1:
+            return original[:i - 1] + original[i:]
+        return original[:i] + edited[j - 1] + original[i:]
+    return original
@@ -22,6 +22,79 @@ class Edit:
         self.c2 = c2
 
 
+def classify_edit(edited, original):
+    """Single-pass equivalent of `EmpiricalEditProbabilityModel.get_edit` that
+    returns a plain tuple (edit_type, c1, c2), or None where `get_edit` returns
+    None. It gives exactly the same answers, quirks included: an insertion or
+    deletion of the last character has c1 = 'a', and two mismatches of equal
+    length strings count as a transposition of the first mismatched pair.
+    """
+    n = min(len(edited), len(original))
+    p = 0
+    while p < n and edited[p] == original[p]:
+        p += 1
+
+    if len(edited) == len(original):
+        if p == n:
+            return None
+        if edited[p + 1:] == original[p + 1:]:
+            return Edit.SUBSTITUTION, edited[p], original[p]
+        q = p + 1
+        while edited[q] == original[q]:
+            q += 1
+        if edited[q + 1:] == original[q + 1:]:
+            return Edit.TRANSPOSITION, edited[p], original[p]
+        return None
+    if len(edited) > len(original):
+        if p < len(original):
+            return Edit.INSERTION, original[p - 1] if p else '$', edited[p]
+        return Edit.INSERTION, 'a', edited[-1]
+    if p < len(edited):
+        return Edit.DELETION, original[p - 1] if p else '$', original[p]
+    return Edit.DELETION, 'a', original[-1]
+
+
+def count_edit_range(filename, start, end):
+    """Counts the edits and the characters of the originals of the training
+    examples in bytes `start:end` of `filename`, exactly like
+    `EmpiricalEditProbabilityModel.__init__` does for the whole file.
+
+    Returns:
+        counts (tuple): Tuple (edit_counts, unigram_counts, bigram_counts).
+    """
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).decode('utf-8').split('\n')
+    if lines and not lines[-1].strip():
+        lines.pop()  # Text after the last newline, if any, is a line
+
+    edit_counts = {edit_type: Counter() for edit_type in (Edit.INSERTION, Edit.DELETION,
+                                                          Edit.SUBSTITUTION, Edit.TRANSPOSITION)}
+    originals = []
+    for example in lines:
+        edited, original = example.strip().split('\t')
+        edit = classify_edit(edited, original)
+        if edit:
+            edit_counts[edit[0]][edit[1:]] += 1
+        originals.append(original)
+
+    # Each original is counted with '$' before and after it; joining them with
+    # a single '$' gives exactly those bigrams and no others. Characters are
+    # counted as code points in NumPy rather than one at a time.
+    unigram_counts = Counter()
+    bigram_counts = Counter()
+    if originals:
+        code_points = np.frombuffer(''.join(originals).encode('utf-32-le'), dtype=np.uint32)
+        for code_point, count in zip(*np.unique(code_points, return_counts=True)):
+            unigram_counts[chr(code_point)] = int(count)
+        code_points = np.frombuffer(('$' + '$'.join(originals) + '$').encode('utf-32-le'),
+                                    dtype=np.uint32).astype(np.uint64)
+        pairs = code_points[:-1] << np.uint64(32) | code_points[1:]
+        for pair, count in zip(*np.unique(pairs, return_counts=True)):
+            bigram_counts[(chr(pair >> 32), chr(pair & 0xFFFFFFFF))] = int(count)
+    return edit_counts, unigram_counts, bigram_counts
+
+
 class EmpiricalEditProbabilityModel(BaseEditProbabilityModel):
 
     START_CHAR = ''      # Used to indicate start-of-query
@@ -77,6 +150,77 @@ class EmpiricalEditProbabilityModel(BaseEditProbabilityModel):
         self.alphabet_size = len(self.unigram_counts)
         print(len(self.bigram_counts))
         print(len(self.unigram_counts))
+        self.build_logp_tables()
+
+    @classmethod
+    def from_training_set(cls, training_set_path='pa2-data/training_set/edit1s.txt',
+                          workers=None, num_ranges=None):
+        """Builds an `EmpiricalEditProbabilityModel` with the same counts as
+        `__init__`, by splitting the training set into byte ranges at line
+        boundaries, counting each range in a pool of `workers` processes with
+        `classify_edit`, and merging the counts.
+
+        Args:
+            training_set_path (str): Path to training set of empirical error data.
+            workers (int): Number of worker processes. Defaults to the number
+                of CPUs; 1 counts every range in this process.
+            num_ranges (int): Number of byte ranges. Defaults to 4 per worker.
+        """
+        epm = cls.__new__(cls)
+        epm.unigram_counts = Counter()
+        epm.bigram_counts = Counter()
+        epm.edit_counts = {edit_type: Counter()
+                           for edit_type in (Edit.INSERTION, Edit.DELETION,
+                                             Edit.SUBSTITUTION, Edit.TRANSPOSITION)}
+
+        workers = workers or os.cpu_count() or 1
+        ranges = get_line_ranges(training_set_path, num_ranges or 4 * workers)
+        if workers == 1:
+            partial_counts = (count_edit_range(training_set_path, start, end)
+                              for start, end in ranges)
+            epm.add_counts(partial_counts)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(count_edit_range, training_set_path, start, end)
+                           for start, end in ranges]
+                epm.add_counts(future.result() for future in as_completed(futures))
+        epm.alphabet_size = len(epm.unigram_counts)
+        epm.build_logp_tables()
+        return epm
+
+    def add_counts(self, partial_counts):
+        """Merges partial (edit_counts, unigram_counts, bigram_counts) tuples
+        into the counts of this model."""
+        for edit_counts, unigram_counts, bigram_counts in partial_counts:
+            for edit_type, counts in edit_counts.items():
+                self.edit_counts[edit_type].update(counts)
+            self.unigram_counts.update(unigram_counts)
+            self.bigram_counts.update(bigram_counts)
+
+    def build_logp_tables(self):
+        """Precomputes the log-probability of every edit of every type as a
+        dense table `self.logp_tables[edit_type, char_ids[c1], char_ids[c2]]`,
+        so that scoring an edit is a single array lookup. Edits whose
+        log-probability is undefined under the counts are stored as NaN.
+        """
+        chars = set(self.unigram_counts)
+        for c1, c2 in self.bigram_counts:
+            chars.update((c1, c2))
+        for edits in self.edit_counts.values():
+            for c1, c2 in edits:
+                chars.update((c1, c2))
+        self.char_ids = {c: i for i, c in enumerate(sorted(chars))}
+
+        num_chars = len(self.char_ids)
+        self.logp_tables = np.full((Edit.SUBSTITUTION + 1, num_chars, num_chars), np.nan)
+        for edit_type in self.edit_counts:
+            for c1, i1 in self.char_ids.items():
+                for c2, i2 in self.char_ids.items():
+                    den = self.get_edit_denominator(edit_type, c1, c2)
+                    if den > 0:
+                        count = self.edit_counts[edit_type][(c1, c2)]
+                        self.logp_tables[edit_type, i1, i2] = math.log(count + 1) - math.log(den)
+        self.version += 1
 
     def get_edit(self, edited, original):
         """Gets an `Edit` object describing the type of edit performed on `original`
@@ -185,22 +329,70 @@ class EmpiricalEditProbabilityModel(BaseEditProbabilityModel):
         if edited == original:
             edit_prob =  math.log(self.NO_EDIT_PROB)
         else:
-            edit = self.get_edit(edited, original)
-            count = 0
-            den = 0
-            c1 = edit.c1
-            c2 = edit.c2
-            if self.edit_counts[edit.edit_type][(c1, c2)]:
-                count = self.edit_counts[edit.edit_type][(c1,c2)]
-            
-            if edit.edit_type == Edit.INSERTION or edit.edit_type == Edit.SUBSTITUTION:
-                if c1 in self.unigram_counts:
-                    den = self.unigram_counts[c1] + self.alphabet_size
-            elif edit.edit_type == Edit.DELETION or edit.edit_type == Edit.TRANSPOSITION:
-                if (c1,c2) in self.bigram_counts:
-                    den = self.bigram_counts[(c1,c2)] + (self.alphabet_size * self.alphabet_size)
-            
-            edit_prob = math.log(count + 1) - math.log(den)
+            edit_type, c1, c2 = classify_edit(edited, original)
+            i1 = self.char_ids.get(c1)
+            i2 = self.char_ids.get(c2)
+            edit_prob = math.nan
+            if i1 is not None and i2 is not None:
+                edit_prob = self.logp_tables[edit_type, i1, i2]
+            if math.isnan(edit_prob):
+                edit_prob = self.get_edit_logp_from_counts(edit_type, c1, c2)
+            else:
+                edit_prob = float(edit_prob)
         
         return edit_prob
         ### End your code
+
+    def get_edit_denominator(self, edit_type, c1, c2):
+        """Gets the smoothed count that edits of `edit_type` on (c1, c2) are
+        normalized by, or 0 if the characters were never seen."""
+        if edit_type == Edit.INSERTION or edit_type == Edit.SUBSTITUTION:
+            if c1 in self.unigram_counts:
+                return self.unigram_counts[c1] + self.alphabet_size
+        elif edit_type == Edit.DELETION or edit_type == Edit.TRANSPOSITION:
+            if (c1, c2) in self.bigram_counts:
+                return self.bigram_counts[(c1, c2)] + (self.alphabet_size * self.alphabet_size)
+        return 0
+
+    def get_edit_logp_from_counts(self, edit_type, c1, c2):
+        """Computes the log-probability of an edit directly from the counts.
+        Used for edits that are not covered by `self.logp_tables`."""
+        count = self.edit_counts[edit_type][(c1, c2)]
+        den = self.get_edit_denominator(edit_type, c1, c2)
+        return math.log(count + 1) - math.log(den)
+
+    def get_edit_logp_batch(self, edited_list, original):
+        """Gets the log-probabilities of editing `original` to arrive at each
+        term in `edited_list`, with one gather from `self.logp_tables`.
+
+        Args:
+            edited_list (list of str): Edited terms, each at most one edit
+                from `original`.
+            original (str): Original term.
+
+        Returns:
+            logps (list of float): Log-probability of each edited term given
+                `original`, in the order of `edited_list`.
+        """
+        edit_types = np.zeros(len(edited_list), dtype=np.intp)
+        ids_1 = np.zeros(len(edited_list), dtype=np.intp)
+        ids_2 = np.zeros(len(edited_list), dtype=np.intp)
+        unedited = []
+        for i, edited in enumerate(edited_list):
+            if edited == original:
+                unedited.append(i)
+                continue
+            edit = classify_edit(edited, original)
+            if edit is None or edit[1] not in self.char_ids or edit[2] not in self.char_ids:
+                continue  # Left as type 0, which is NaN and scored below
+            edit_types[i] = edit[0]
+            ids_1[i] = self.char_ids[edit[1]]
+            ids_2[i] = self.char_ids[edit[2]]
+
+        logps = self.logp_tables[edit_types, ids_1, ids_2].tolist()
+        for i in unedited:
+            logps[i] = math.log(self.NO_EDIT_PROB)
+        for i, logp in enumerate(logps):
+            if math.isnan(logp):
+                logps[i] = self.get_edit_logp(edited_list[i], original)
+        return logps
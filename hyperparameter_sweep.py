@@ -0,0 +1,284 @@
+
+
+class SymbolicEditLogp:
+    """Edit log-probability of a candidate kept as logp + num_no_edits *
+    log(NO_EDIT_PROB), so that it can be re-evaluated for any no-edit
+    probability without generating the candidate again. Supports the
+    arithmetic and comparisons `CandidateGenerator` does on edit
+    log-probabilities; comparisons use the value under `log_no_edit`.
+    """
+
+    __slots__ = ('logp', 'num_no_edits', 'log_no_edit')
+
+    def __init__(self, logp, num_no_edits, log_no_edit):
+        self.logp = logp                  # Log-probability of the actual edits
+        self.num_no_edits = num_no_edits  # Number of unedited terms (or queries)
+        self.log_no_edit = log_no_edit    # Log no-edit probability to compare under
+
+    def __float__(self):
+        return self.logp + self.num_no_edits * self.log_no_edit
+
+    def __add__(self, other):
+        if isinstance(other, SymbolicEditLogp):
+            return SymbolicEditLogp(self.logp + other.logp, self.num_no_edits + other.num_no_edits,
+                                    self.log_no_edit)
+        return SymbolicEditLogp(self.logp + other, self.num_no_edits, self.log_no_edit)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return SymbolicEditLogp(-self.logp, -self.num_no_edits, self.log_no_edit)
+
+    def __sub__(self, other):
+        return self + -other
+
+    def __rsub__(self, other):
+        return -self + other
+
+    def __mul__(self, factor):
+        return SymbolicEditLogp(self.logp * factor, self.num_no_edits * factor, self.log_no_edit)
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        if isinstance(other, SymbolicEditLogp):
+            return self.logp == other.logp and self.num_no_edits == other.num_no_edits
+        return float(self) == other
+
+    def __hash__(self):
+        return hash((self.logp, self.num_no_edits))
+
+    def __lt__(self, other):
+        return float(self) < float(other)
+
+    def __le__(self, other):
+        return float(self) <= float(other)
+
+    def __gt__(self, other):
+        return float(self) > float(other)
+
+    def __ge__(self, other):
+        return float(self) >= float(other)
+
+
+class SymbolicEditModel:
+    """Wraps an `EditProbabilityModel` so that its log-probabilities are
+    `SymbolicEditLogp`s: an unedited term counts as one no-edit, and any other
+    edit keeps the log-probability of `epm`. Other attributes are those of
+    `epm`."""
+
+    def __init__(self, epm):
+        self.epm = epm
+        self.log_no_edit = epm.get_edit_logp('a', 'a')
+
+    def __getattr__(self, name):
+        return getattr(self.epm, name)
+
+    def get_edit_logp(self, edited, original):
+        if edited == original:
+            return SymbolicEditLogp(0., 1, self.log_no_edit)
+        return SymbolicEditLogp(self.epm.get_edit_logp(edited, original), 0, self.log_no_edit)
+
+    def get_edit_logp_batch(self, edited_list, original):
+        return [SymbolicEditLogp(0., 1, self.log_no_edit) if edited == original
+                else SymbolicEditLogp(logp, 0, self.log_no_edit)
+                for edited, logp in zip(edited_list, self.epm.get_edit_logp_batch(edited_list, original))]
+
+
+def cache_query_candidates(cg, lm, raw, gold):
+    """Generates the candidates of dev query `raw` once, and keeps what scoring
+    them needs under any mu, lambda and no-edit probability.
+
+    Args:
+        cg (CandidateGenerator): Generator over a `SymbolicEditModel`.
+        lm (LanguageModel): Language model of the generator.
+        raw (str): Raw dev query.
+        gold (str): Intended query.
+
+    Returns:
+        candidates (dict): Arrays over the candidates, in generation order:
+            'edit_logps' and 'num_no_edits' (see `SymbolicEditLogp`),
+            'unigram_probs' (P(w_1) of each candidate), 'is_gold', and over the
+            bigrams of every candidate, in order: 'bigram_candidates' (index of
+            the candidate), 'next_unigram_probs' (count(w_2) / N) and
+            'bigram_probs' (count(w_1, w_2) / count(w_1)). Also 'raw_is_gold'.
+    """
+    query_tkns = raw.split()
+    total = lm.total_num_tokens
+    edit_logps, num_no_edits, unigram_probs, is_gold = [], [], [], []
+    bigram_candidates, next_unigram_probs, bigram_probs = [], [], []
+    for edit_logp, spans in cg.get_candidate_edits(raw):
+        tokens = cg.build_candidate(query_tkns, spans).split()
+        if not tokens:
+            continue  # Candidate with no terms left
+        index = len(edit_logps)
+        edit_logps.append(edit_logp.logp)
+        num_no_edits.append(edit_logp.num_no_edits)
+        unigram_probs.append(lm.unigram_counts[tokens[0]] / total)
+        is_gold.append(' '.join(tokens) == gold)
+        for w_1, w_2 in zip(tokens, tokens[1:]):
+            count_1 = lm.unigram_counts[w_1]
+            bigram_candidates.append(index)
+            next_unigram_probs.append(lm.unigram_counts[w_2] / total)
+            bigram_probs.append(lm.bigram_counts[(w_1, w_2)] / count_1 if count_1 else math.nan)
+    return {'edit_logps': np.array(edit_logps, dtype=np.float64),
+            'num_no_edits': np.array(num_no_edits, dtype=np.float64),
+            'unigram_probs': np.array(unigram_probs, dtype=np.float64),
+            'is_gold': np.array(is_gold, dtype=bool),
+            'bigram_candidates': np.array(bigram_candidates, dtype=np.int64),
+            'next_unigram_probs': np.array(next_unigram_probs, dtype=np.float64),
+            'bigram_probs': np.array(bigram_probs, dtype=np.float64),
+            'raw_is_gold': raw == gold}
+
+
+sweep_generator = None  # Symbolic `CandidateGenerator` of the current worker process
+
+
+def init_sweep_worker(lm, epm, generator_kwargs):
+    global sweep_generator
+    sweep_generator = CandidateGenerator(lm, SymbolicEditModel(epm), **generator_kwargs)
+
+
+def cache_query_candidates_in_worker(dev_pair):
+    return cache_query_candidates(sweep_generator, sweep_generator.lm, *dev_pair)
+
+
+class SweepCache:
+    """Candidates of every query of a dev set, generated once, concatenated
+    into flat arrays so that a whole grid of hyper-parameters can be scored
+    with a few NumPy operations (see `sweep`)."""
+
+    def __init__(self, lm, epm, dev_set, workers=1, **generator_kwargs):
+        """
+        Args:
+            lm (LanguageModel): Language model to generate candidates with.
+            epm (EditProbabilityModel): Edit probability model to generate
+                candidates with; its no-edit probability is swept.
+            dev_set (list): Tuples (raw query, intended query), e.g. from
+                `load_dev_set`.
+            workers (int): Number of processes generating candidates.
+            **generator_kwargs: Other arguments of `CandidateGenerator`, e.g.
+                an `index`. The term cache is not supported.
+        """
+        start = time.perf_counter()
+        if workers == 1:
+            init_sweep_worker(lm, epm, generator_kwargs)
+            per_query = [cache_query_candidates_in_worker(dev_pair) for dev_pair in tqdm(dev_set)]
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_sweep_worker,
+                                     initargs=(lm, epm, generator_kwargs)) as executor:
+                per_query = list(executor.map(cache_query_candidates_in_worker, dev_set,
+                                              chunksize=16))
+        self.num_queries = len(dev_set)
+        self.cache_seconds = time.perf_counter() - start
+
+        counts = np.array([len(query['edit_logps']) for query in per_query], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.query_ids = np.repeat(np.arange(self.num_queries), counts)
+        self.raw_is_gold = np.array([query['raw_is_gold'] for query in per_query], dtype=bool)
+        for name in ('edit_logps', 'num_no_edits', 'unigram_probs', 'is_gold',
+                     'next_unigram_probs', 'bigram_probs'):
+            setattr(self, name, np.concatenate([query[name] for query in per_query]))
+        self.bigram_candidates = np.concatenate(
+            [query['bigram_candidates'] + offset
+             for query, offset in zip(per_query, self.offsets[:-1])]).astype(np.int64)
+
+    @property
+    def num_candidates(self):
+        return len(self.edit_logps)
+
+    def get_query_logps(self, lambda_):
+        """Computes `LanguageModel.get_query_logp` of every candidate under
+        interpolation factor `lambda_`."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_ps = np.log(self.unigram_probs)
+            bigram_logps = np.log(lambda_ * self.next_unigram_probs
+                                  + (1 - lambda_) * self.bigram_probs)
+        log_ps += np.bincount(self.bigram_candidates, weights=bigram_logps,
+                              minlength=self.num_candidates)
+        log_ps[np.isnan(log_ps)] = -np.inf
+        return log_ps
+
+    def get_accuracy(self, scores):
+        """Gets the fraction of queries whose best candidate under `scores` (the
+        first one, on ties, like `correct_spelling`) is the intended query.
+        Queries without candidates are left as they are.
+
+        Args:
+            scores (np.ndarray): Array of shape (num_candidates, num_settings).
+        """
+        correct = self.raw_is_gold[:, None].repeat(scores.shape[1], axis=1)
+        has_candidates = self.offsets[:-1] < self.offsets[1:]
+        if self.num_candidates:
+            starts = self.offsets[:-1][has_candidates]
+            best_scores = np.maximum.reduceat(scores, starts, axis=0)
+            is_best = scores == best_scores[np.searchsorted(starts, np.arange(self.num_candidates),
+                                                            side='right') - 1]
+            positions = np.where(is_best, np.arange(self.num_candidates)[:, None], self.num_candidates)
+            first_best = np.minimum.reduceat(positions, starts, axis=0)
+            correct[has_candidates] = self.is_gold[first_best]
+        return correct.mean(axis=0) if self.num_queries else np.zeros(scores.shape[1])
+
+
+def sweep(cache, mus, lambdas, no_edit_probs):
+    """Scores every candidate of `cache` under every combination of the
+    hyper-parameters, and measures accuracy on the dev set for each.
+
+    Args:
+        cache (SweepCache): Candidates of the dev set.
+        mus (list of float): Weights of the language model to try.
+        lambdas (list of float): Interpolation factors of the language model.
+        no_edit_probs (list of float): Probabilities of leaving a term
+            unedited (`EmpiricalEditProbabilityModel.NO_EDIT_PROB`).
+
+    Returns:
+        results (list of dict): Accuracy of each setting, best first.
+    """
+    start = time.perf_counter()
+    # Edit log-probabilities under every no-edit probability: (candidates, no-edit probs)
+    edit_logps = (cache.edit_logps[:, None]
+                  + cache.num_no_edits[:, None] * np.log(np.asarray(no_edit_probs))[None, :])
+    results = []
+    for lambda_ in lambdas:
+        query_logps = cache.get_query_logps(lambda_)
+        # Scores under every (mu, no-edit probability): (candidates, mus * no-edit probs)
+        scores = (edit_logps[:, None, :]
+                  + np.asarray(mus)[None, :, None] * query_logps[:, None, None]).reshape(
+                      cache.num_candidates, -1)
+        accuracies = cache.get_accuracy(scores).reshape(len(mus), len(no_edit_probs))
+        for i, mu in enumerate(mus):
+            for j, no_edit_prob in enumerate(no_edit_probs):
+                results.append({'mu': mu, 'lambda_': lambda_, 'no_edit_prob': no_edit_prob,
+                                'accuracy': float(accuracies[i, j])})
+    results.sort(key=lambda result: -result['accuracy'])
+    print('Scored {:,} settings over {:,} candidates of {:,} queries in {:.2f}s'.format(
+        len(results), cache.num_candidates, cache.num_queries, time.perf_counter() - start))
+    return results
+
+
+def run_sweep(lm, epm, dev_set, mus, lambdas, no_edit_probs, workers=1, top=10,
+              **generator_kwargs):
+    """Generates the candidates of `dev_set` once, sweeps the grid of
+    hyper-parameters over them, and prints the best settings.
+
+    To correct with a setting, build the language model with its `lambda_`,
+    set `NO_EDIT_PROB` of the empirical edit model to its `no_edit_prob`
+    before the model is first used, and pass its `mu` to the scorer:
+
+        >>> best = run_sweep(lm, epm, dev_set, mus, lambdas, no_edit_probs)[0]
+        >>> lm = LanguageModel.from_corpus(corpus_dir, lambda_=best['lambda_'])
+        >>> epm.NO_EDIT_PROB = best['no_edit_prob']
+        >>> cs = CandidateScorer(lm, CandidateGenerator(lm, epm), mu=best['mu'])
+
+    Returns:
+        results (list of dict): Accuracy of each setting, best first.
+    """
+    cache = SweepCache(lm, epm, dev_set, workers, **generator_kwargs)
+    print('Generated {:,} candidates for {:,} queries in {:.2f}s'.format(
+        cache.num_candidates, cache.num_queries, cache.cache_seconds))
+    results = sweep(cache, mus, lambdas, no_edit_probs)
+    print('{:>8} {:>8} {:>12} {:>9}'.format('mu', 'lambda', 'no_edit_prob', 'accuracy'))
+    for result in results[:top]:
+        print('{:>8.3f} {:>8.3f} {:>12.3f} {:>9.2%}'.format(
+            result['mu'], result['lambda_'], result['no_edit_prob'], result['accuracy']))
+    return results
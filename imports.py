@@ -1,9 +1,39 @@
 
 # Import modules
+import argparse
+import asyncio
 import math
 import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import bisect
+import codecs
+import hashlib
+import heapq
+import json
+import logging
+import mmap
+import struct
+import threading
+import time
 import urllib.request
+import weakref
+import zlib
 import zipfile
-from collections import Counter
+from array import array
+from collections import Counter, OrderedDict, deque
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed, wait)
+from multiprocessing import shared_memory
+import numpy as np
 from tqdm import tqdm
 import glob
+try:
+    import resource  # Unix only, for peak memory in benchmarks
+except ImportError:
+    resource = None
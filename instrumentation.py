@@ -0,0 +1,278 @@
+
+
+class QueryProfile:
+    """Number of calls and time spent in each stage of correcting one query,
+    plus counters of the items (candidates, edits, ...) each stage handled.
+    Stage times are inclusive: a stage that calls another includes its time.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.correction = None
+        self.seconds = 0.
+        self.calls = Counter()          # Maps stage -> number of calls
+        self.stage_seconds = Counter()  # Maps stage -> seconds spent in calls
+        self.counts = Counter()         # Maps counter name -> number of items
+
+    def add(self, stage, seconds):
+        self.calls[stage] += 1
+        self.stage_seconds[stage] += seconds
+
+    def to_dict(self):
+        return {'query': self.query, 'correction': self.correction, 'seconds': self.seconds,
+                'stages': {stage: {'calls': self.calls[stage], 'seconds': self.stage_seconds[stage]}
+                           for stage in sorted(self.calls)},
+                'counts': dict(self.counts)}
+
+
+class Instrumentation:
+    """Opt-in per-stage profiling of a `CandidateScorer` and the models behind it.
+
+    `instrument` wraps the methods of each stage on the scorer, its candidate
+    generator, edit probability model and language model instances (not their
+    classes), and `uninstrument` removes the wrappers again, so a scorer that
+    is not instrumented runs exactly the original code. While instrumented,
+    each `correct_spelling` call records a `QueryProfile`, which is passed (as
+    a dict) to every sink: a callable such as `LogSink`, `PrometheusSink`, or
+    any function. Queries slower than `slow_query_ms` are also kept in
+    `slow_queries` and logged as warnings.
+
+    The stages of every decoding mode are timed under 'correction', and the
+    candidates scored by the exhaustive and vectorized modes are counted as
+    'ranked_candidates'. The lattice decoder does not enumerate candidates,
+    so in that mode only its language model calls are broken down.
+
+    Profiles are kept per thread, so a scorer may be instrumented while
+    several threads correct queries with it; sinks are called under a lock.
+    Wrapped instances cannot be pickled, so instrument scorers that correct
+    queries in this process, not ones handed to worker processes.
+
+    Example:
+        >>> prometheus = PrometheusSink()
+        >>> with Instrumentation([prometheus], slow_query_ms=50).instrument(cs):
+        ...     cs.correct_spelling('teh quick brwn fox')
+        >>> print(prometheus.render())
+    """
+
+    def __init__(self, sinks=(), slow_query_ms=None, slow_query_log_size=100):
+        """
+        Args:
+            sinks (list of callable): Functions called with the dict of every
+                query profile.
+            slow_query_ms (float): Queries taking longer than this are kept
+                in the slow-query log. None disables the log.
+            slow_query_log_size (int): Number of slow queries to keep.
+        """
+        self.sinks = list(sinks)
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = deque(maxlen=slow_query_log_size)
+        self.local = threading.local()  # Profile of the query each thread is correcting
+        self.lock = threading.Lock()     # Guards the slow-query log and the sinks
+        self.wrapped = []     # Tuples (instance, method name) of the wrappers
+        self.logger = logging.getLogger('spelling.instrumentation')
+
+    @property
+    def profile(self):
+        """Profile of the query being corrected by the current thread, if any."""
+        return getattr(self.local, 'profile', None)
+
+    @profile.setter
+    def profile(self, profile):
+        self.local.profile = profile
+
+    def instrument(self, cs):
+        """Wraps the stages of scorer `cs`, its candidate generator and models.
+
+        Returns:
+            self, so that it can be used as a context manager which
+                uninstruments on exit.
+        """
+        cg = cs.cg
+        self.wrap_query(cs)
+        self.wrap(cs, 'compute_spelling_correction', 'correction')
+        self.wrap(cs, 'search_topk', 'ranking')
+        self.wrap(cs, 'get_scores', 'vectorized_scoring', 'ranked_candidates', len)
+        self.wrap_delta_scorer(cs)
+
+        self.wrap_generator(cg, 'get_candidate_edits', 'candidate_generation', 'candidates_generated')
+        self.wrap(cg, 'is_in_vocab', 'oov_filter', 'candidates_in_vocab', int)
+        self.wrap(cg, 'get_num_oov', 'oov_check')
+        self.wrap(cg, 'get_candidates_for_term', 'term_candidates', 'term_candidates', len)
+        self.wrap(cg, 'get_one_edit_tokens', 'one_edit_expansion', 'one_edit_tokens', len)
+        if cg.index is not None:
+            self.wrap(cg.index, 'lookup', 'index_lookup', 'index_matches', len)
+
+        self.wrap(cg.epm, 'get_edit_logp', 'edit_logp')
+        self.wrap(cg.epm, 'get_edit_logp_batch', 'edit_logp_batch', 'edit_logp_batch_items', len)
+
+        for lm in {id(cs.lm): cs.lm, id(cg.lm): cg.lm}.values():
+            self.wrap(lm, 'get_unigram_logp', 'lm_unigram')
+            self.wrap(lm, 'get_bigram_logp', 'lm_bigram')
+            self.wrap(lm, 'get_query_logp', 'lm_query')
+        return self
+
+    def uninstrument(self):
+        """Removes every wrapper added by `instrument`."""
+        for obj, name in reversed(self.wrapped):
+            vars(obj).pop(name, None)
+        self.wrapped = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstrument()
+
+    def wrap(self, obj, name, stage, counter=None, get_count=None):
+        """Wraps method `name` of instance `obj` to record its calls under
+        `stage`, and add get_count(result) to `counter`."""
+        setattr(obj, name, self.get_wrapper(getattr(obj, name), stage, counter, get_count))
+        self.wrapped.append((obj, name))
+
+    def get_wrapper(self, method, stage, counter=None, get_count=None):
+        """Gets the wrapper of bound `method` that `wrap` installs."""
+
+        def wrapper(*args, **kwargs):
+            profile = self.profile
+            if profile is None:
+                return method(*args, **kwargs)
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            profile.add(stage, time.perf_counter() - start)
+            if counter is not None:
+                profile.counts[counter] += get_count(result)
+            return result
+
+        return wrapper
+
+    def wrap_delta_scorer(self, cs):
+        """Wraps `cs.get_delta_scorer`, so that the `QueryDeltaScorer` of each
+        search records its calls under 'candidate_scoring' and counts the
+        candidates it scores."""
+        method = cs.get_delta_scorer
+
+        def wrapper(*args, **kwargs):
+            delta_scorer = method(*args, **kwargs)
+            if self.profile is not None:
+                # Lives for one search only, so it is not kept in `self.wrapped`
+                delta_scorer.get_query_logp = self.get_wrapper(
+                    delta_scorer.get_query_logp, 'candidate_scoring', 'ranked_candidates',
+                    lambda query_logp: int(query_logp is not None))
+            return delta_scorer
+
+        setattr(cs, 'get_delta_scorer', wrapper)
+        self.wrapped.append((cs, 'get_delta_scorer'))
+
+    def wrap_generator(self, obj, name, stage, counter):
+        """Same as `wrap` for a generator method: only the time spent producing
+        items is recorded, not the time the caller spends consuming them, and
+        `counter` counts the items."""
+        method = getattr(obj, name)
+
+        def wrapper(*args, **kwargs):
+            profile = self.profile
+            items = method(*args, **kwargs)
+            if profile is None:
+                yield from items
+                return
+            profile.calls[stage] += 1
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    profile.stage_seconds[stage] += time.perf_counter() - start
+                    return
+                profile.stage_seconds[stage] += time.perf_counter() - start
+                profile.counts[counter] += 1
+                yield item
+
+        setattr(obj, name, wrapper)
+        self.wrapped.append((obj, name))
+
+    def wrap_query(self, cs):
+        """Wraps `cs.correct_spelling` to record one profile per query."""
+        method = cs.correct_spelling
+
+        def wrapper(r, *args, **kwargs):
+            if self.profile is not None:  # Nested call, part of the current query
+                return method(r, *args, **kwargs)
+            profile = self.profile = QueryProfile(r)
+            start = time.perf_counter()
+            try:
+                profile.correction = method(r, *args, **kwargs)
+                return profile.correction
+            finally:
+                profile.seconds = time.perf_counter() - start
+                self.profile = None
+                self.emit(profile)
+
+        setattr(cs, 'correct_spelling', wrapper)
+        self.wrapped.append((cs, 'correct_spelling'))
+
+    def emit(self, profile):
+        """Passes `profile` to the sinks and, if slow, to the slow-query log."""
+        profile = profile.to_dict()
+        with self.lock:
+            if self.slow_query_ms is not None and profile['seconds'] * 1000. > self.slow_query_ms:
+                self.slow_queries.append(profile)
+                self.logger.warning('Slow query %r took %.1f ms: %s', profile['query'],
+                                    profile['seconds'] * 1000., format_profile(profile))
+            for sink in self.sinks:
+                sink(profile)
+
+
+def format_profile(profile):
+    """Formats the stages of a profile dict, slowest first, on one line."""
+    stages = sorted(profile['stages'].items(), key=lambda stage: -stage[1]['seconds'])
+    return ', '.join('{} {}x {:.1f}ms'.format(stage, stats['calls'], stats['seconds'] * 1000.)
+                     for stage, stats in stages)
+
+
+class LogSink:
+    """Sink that logs every query profile."""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('spelling.instrumentation')
+        self.level = level
+
+    def __call__(self, profile):
+        self.logger.log(self.level, 'Query %r -> %r in %.1f ms: %s %s', profile['query'],
+                        profile['correction'], profile['seconds'] * 1000.,
+                        format_profile(profile), profile['counts'])
+
+
+class PrometheusSink:
+    """Sink that aggregates query profiles into counters, rendered in the
+    Prometheus text exposition format by `render`."""
+
+    def __init__(self, prefix='spelling'):
+        self.prefix = prefix
+        self.queries = 0
+        self.seconds = 0.
+        self.calls = Counter()
+        self.stage_seconds = Counter()
+        self.counts = Counter()
+
+    def __call__(self, profile):
+        self.queries += 1
+        self.seconds += profile['seconds']
+        for stage, stats in profile['stages'].items():
+            self.calls[stage] += stats['calls']
+            self.stage_seconds[stage] += stats['seconds']
+        self.counts.update(profile['counts'])
+
+    def render(self):
+        """Renders the aggregated counters as Prometheus text."""
+        lines = ['# TYPE {}_query_seconds summary'.format(self.prefix),
+                 '{}_query_seconds_count {}'.format(self.prefix, self.queries),
+                 '{}_query_seconds_sum {!r}'.format(self.prefix, self.seconds)]
+        for name, values in (('stage_calls_total', self.calls),
+                             ('stage_seconds_total', self.stage_seconds)):
+            lines.append('# TYPE {}_{} counter'.format(self.prefix, name))
+            lines += ['{}_{}{{stage="{}"}} {!r}'.format(self.prefix, name, stage, values[stage])
+                      for stage in sorted(values)]
+        lines.append('# TYPE {}_items_total counter'.format(self.prefix))
+        lines += ['{}_items_total{{counter="{}"}} {}'.format(self.prefix, counter, self.counts[counter])
+                  for counter in sorted(self.counts)]
+        return '\n'.join(lines) + '\n'
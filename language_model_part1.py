@@ -1,8 +1,172 @@
 
 
+def get_line_ranges(filename, num_ranges):
+    """Splits `filename` into at most `num_ranges` byte ranges of about equal
+    size, each starting at the beginning of a line.
+
+    Returns:
+        ranges (list): List of tuples (start, end) of byte offsets.
+    """
+    size = os.path.getsize(filename)
+    starts = [0]
+    with open(filename, 'rb') as f:
+        for i in range(1, num_ranges):
+            f.seek(max(size * i // num_ranges, starts[-1]))
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > starts[-1]:
+                starts.append(f.tell())
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def read_token_chunks(filename, chunk_size=1 << 20, start=0, end=None):
+    """Yields the whitespace-separated tokens of bytes `start:end` of UTF-8
+    file `filename` as lists, reading at most `chunk_size` bytes at a time. A
+    token cut by a chunk boundary is carried over to the next chunk, so the
+    tokens are exactly those of `f.read().split()` over the range.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    carry = ''
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        while True:
+            data = f.read(chunk_size if end is None else min(chunk_size, end - f.tell()))
+            chunk = decoder.decode(data, final=not data)
+            if not data:
+                break
+            if not chunk:
+                continue  # Only part of a multi-byte character so far
+            tokens = (carry + chunk).split()
+            carry = ''
+            if tokens and not chunk[-1].isspace():
+                carry = tokens.pop()
+            if tokens:
+                yield tokens
+    if carry:
+        yield [carry]
+
+
+def count_corpus_range(filename, start=0, end=None, chunk_size=1 << 20):
+    """Counts the unigrams and bigrams of bytes `start:end` of a corpus file,
+    streaming them in chunks of `chunk_size` bytes. `start` must be the
+    beginning of a line (see `get_line_ranges`).
+
+    Returns:
+        counts (tuple): Tuple (unigram_counts, bigram_counts, num_tokens).
+        boundary (tuple): Tuple (first token, last token) of the range, to
+            count the bigrams across ranges, or None if it has no tokens.
+    """
+    unigram_counts = Counter()
+    bigram_counts = Counter()
+    num_tokens = 0
+    first_token = last_token = None
+    for tokens in read_token_chunks(filename, chunk_size, start, end):
+        unigram_counts.update(tokens)
+        bigram_counts.update(zip(tokens, tokens[1:]))
+        if last_token is None:
+            first_token = tokens[0]
+        else:
+            bigram_counts[(last_token, tokens[0])] += 1
+        last_token = tokens[-1]
+        num_tokens += len(tokens)
+    boundary = None if first_token is None else (first_token, last_token)
+    return (unigram_counts, bigram_counts, num_tokens), boundary
+
+
+def count_corpus_file(filename, chunk_size=1 << 20):
+    """Counts the unigrams and bigrams of a single corpus file, streaming it in
+    chunks of `chunk_size` bytes.
+
+    Returns:
+        counts (tuple): Tuple (unigram_counts, bigram_counts, num_tokens).
+    """
+    return count_corpus_range(filename, chunk_size=chunk_size)[0]
+
+
+def map_bounded(executor, function, args_list, max_in_flight):
+    """Yields tuples (args, function(*args)) for each of `args_list`, in the
+    order they complete in `executor`. At most `max_in_flight` calls are
+    submitted at a time, so that results never pile up faster than the
+    caller consumes them.
+    """
+    pending = {}  # Maps futures -> their args
+    for args in args_list:
+        if len(pending) >= max_in_flight:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+        pending[executor.submit(function, *args)] = args
+    for future in as_completed(pending):
+        yield pending[future], future.result()
+
+
+def count_document(text):
+    """Counts the unigrams and bigrams of a single document.
+
+    Returns:
+        counts (tuple): Tuple (unigram_counts, bigram_counts, num_tokens).
+    """
+    tokens = text.split()
+    return Counter(tokens), Counter(zip(tokens, tokens[1:])), len(tokens)
+
+
+class ReadWriteLock:
+    """Lock held by any number of readers at once, or by a single writer.
+    Waiting writers keep new readers out, so that updates are not starved.
+    Reads are reentrant, including from the thread holding the write lock.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.waiting_writers = 0
+        self.writer = None  # Thread id of the writer holding the lock
+        self.local = threading.local()
+
+    @contextmanager
+    def reading(self):
+        """Holds the lock as a reader for the duration of a `with` block."""
+        depth = getattr(self.local, 'depth', 0)
+        nested = depth > 0 or self.writer == threading.get_ident()
+        if not nested:
+            with self.condition:
+                while self.writer is not None or self.waiting_writers:
+                    self.condition.wait()
+                self.readers += 1
+        self.local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            if not nested:
+                with self.condition:
+                    self.readers -= 1
+                    if not self.readers:
+                        self.condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        """Holds the lock as the writer for the duration of a `with` block."""
+        with self.condition:
+            self.waiting_writers += 1
+            while self.writer is not None or self.readers:
+                self.condition.wait()
+            self.waiting_writers -= 1
+            self.writer = threading.get_ident()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer = None
+                self.condition.notify_all()
+
+
 class LanguageModel:
     """Models prior probability of unigrams and bigrams."""
 
+    version = 0  # Bumped whenever the counts change, to invalidate caches
+
     def __init__(self, corpus_dir='pa2-data/corpus', lambda_=0.05):
         """Iterates over all whitespace-separated tokens in each file in
         `corpus_dir`, and counts the number of occurrences of each unigram and
@@ -34,3 +198,195 @@ class LanguageModel:
                         self.bigram_counts[tuple((last_token, token))] += 1
                     last_token = token
         ### End your code
+
+    @classmethod
+    def from_corpus(cls, corpus_dir='pa2-data/corpus', lambda_=0.05, workers=None,
+                    chunk_size=1 << 20, range_size=1 << 24):
+        """Builds a `LanguageModel` by counting the files in `corpus_dir` in a
+        pool of `workers` processes and merging their partial counts. Files
+        larger than `range_size` bytes are split into ranges of lines counted
+        separately, so that a single large file is counted in parallel too,
+        and the bigrams across ranges are added back. Ranges are streamed in
+        chunks of `chunk_size` bytes, and only a few more ranges than workers
+        are counted at a time, so peak memory is bounded by the chunk size and
+        the number of workers rather than by the size of the corpus.
+
+        Unlike `__init__`, bigrams never span two files.
+
+        Args:
+            corpus_dir (str): Path to directory containing corpus.
+            lambda_ (float): Interpolation factor for smoothing by unigram-bigram
+                interpolation.
+            workers (int): Number of worker processes. Defaults to the number
+                of CPUs; 1 counts every file in this process.
+            chunk_size (int): Number of bytes read from a file at a time.
+            range_size (int): Approximate number of bytes of each range.
+        """
+        lm = cls.__new__(cls)
+        lm.lambda_ = lambda_
+        lm.total_num_tokens = 0
+        lm.unigram_counts = Counter()
+        lm.bigram_counts = Counter()
+
+        files = glob.glob(os.path.join(corpus_dir, '*.*'))
+        ranges = [(filename, start, end, chunk_size) for filename in files
+                  for start, end in get_line_ranges(
+                      filename, max(1, -(-os.path.getsize(filename) // range_size)))]
+        workers = workers or os.cpu_count() or 1
+        boundaries = {}  # Maps (filename, start) -> (first token, last token) of a range
+
+        def get_partial_counts(results):
+            for (filename, start, _, _), (counts, boundary) in results:
+                boundaries[(filename, start)] = boundary
+                yield counts
+            # Bigrams from the last token of each range to the first of the next
+            bigram_counts = Counter()
+            last_tokens = {}  # Maps filename -> last token of its ranges so far
+            for filename, start, _, _ in ranges:
+                boundary = boundaries[(filename, start)]
+                if boundary is None:
+                    continue
+                if filename in last_tokens:
+                    bigram_counts[(last_tokens[filename], boundary[0])] += 1
+                last_tokens[filename] = boundary[1]
+            yield Counter(), bigram_counts, 0
+
+        if workers == 1:
+            lm.add_counts(get_partial_counts((args, count_corpus_range(*args)) for args in ranges))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                lm.add_counts(get_partial_counts(
+                    map_bounded(executor, count_corpus_range, ranges, 2 * workers)))
+        return lm
+
+    def add_counts(self, partial_counts):
+        """Merges partial (unigram_counts, bigram_counts, num_tokens) tuples
+        into the counts of this `LanguageModel`."""
+        for unigram_counts, bigram_counts, num_tokens in partial_counts:
+            self.unigram_counts.update(unigram_counts)
+            self.bigram_counts.update(bigram_counts)
+            self.total_num_tokens += num_tokens
+        self.version += 1
+
+    @property
+    def lock(self):
+        """`ReadWriteLock` that queries hold as readers while they are scored,
+        and `add_documents`/`remove_documents` hold as the writer while they
+        apply their changes, so that a query never sees a partial update."""
+        lock = self.__dict__.get('_lock')
+        if lock is None:
+            lock = self.__dict__.setdefault('_lock', ReadWriteLock())
+        return lock
+
+    def __getstate__(self):
+        # Locks and listeners stay with this process
+        state = self.__dict__.copy()
+        state.pop('_lock', None)
+        state.pop('vocabulary_listeners', None)
+        return state
+
+    def add_vocabulary_listener(self, listener):
+        """Registers listener(added_words, removed_words) to be called, under
+        the write lock, whenever `add_documents` or `remove_documents` changes
+        the vocabulary. Bound methods are held weakly, so an index does not
+        outlive its last user just because it listens to this model.
+        """
+        if not hasattr(self, 'vocabulary_listeners'):
+            self.vocabulary_listeners = []
+        if hasattr(listener, '__self__'):
+            self.vocabulary_listeners.append(weakref.WeakMethod(listener))
+        else:
+            self.vocabulary_listeners.append(lambda: listener)
+
+    def add_documents(self, documents):
+        """Adds the counts of `documents` to this `LanguageModel`. Only the
+        documents are counted, so the cost is proportional to their size, not
+        to the size of the corpus. Like `from_corpus`, bigrams never span two
+        documents.
+
+        Only the counts and the vocabulary indexes (through the vocabulary
+        listeners) are updated incrementally. Everything else that is derived
+        from the counts is tied to `version` and is rebuilt in full after
+        each update. The `LanguageModelArrays` of a scorer are rebuilt over
+        the whole vocabulary and bigram table on its next vectorized call.
+        The term cache is cleared entirely. So is the query cache, which
+        cannot be patched, since a new token count changes the probability of
+        every query. Adding documents in batches
+        rather than one at a time amortizes these rebuilds.
+
+        Args:
+            documents (iterable of str): Texts of the new documents.
+
+        Returns:
+            changes (tuple): Tuple (added_words, removed_words) of the changes
+                to the vocabulary.
+        """
+        return self.apply_counts_delta((count_document(text) for text in documents), 1)
+
+    def remove_documents(self, documents):
+        """Subtracts the counts of `documents`, which must have been added
+        before (with `add_documents`, or as files of the corpus). Words and
+        bigrams whose count drops to 0 are removed from the vocabulary. Derived
+        structures are rebuilt as after `add_documents`.
+
+        Args:
+            documents (iterable of str): Texts of the documents to remove.
+
+        Returns:
+            changes (tuple): Tuple (added_words, removed_words) of the changes
+                to the vocabulary.
+
+        Raises:
+            ValueError: If a count would become negative. Nothing is removed.
+        """
+        return self.apply_counts_delta((count_document(text) for text in documents), -1)
+
+    def apply_counts_delta(self, partial_counts, sign):
+        """Adds (sign=1) or subtracts (sign=-1) partial (unigram_counts,
+        bigram_counts, num_tokens) tuples, atomically for readers holding
+        `self.lock`, then notifies the vocabulary listeners."""
+        unigram_delta = Counter()
+        bigram_delta = Counter()
+        num_tokens = 0
+        for unigram_counts, bigram_counts, partial_num_tokens in partial_counts:
+            unigram_delta.update(unigram_counts)
+            bigram_delta.update(bigram_counts)
+            num_tokens += partial_num_tokens
+
+        with self.lock.writing():
+            if sign < 0:
+                for counts, delta in ((self.unigram_counts, unigram_delta),
+                                      (self.bigram_counts, bigram_delta)):
+                    for key, count in delta.items():
+                        if counts.get(key, 0) < count:
+                            raise ValueError('Cannot remove {!r} {} time(s), its count is {}'.format(
+                                key, count, counts.get(key, 0)))
+
+            added_words, removed_words = [], []
+            for word, count in unigram_delta.items():
+                old_count = self.unigram_counts.get(word, 0)
+                new_count = old_count + sign * count
+                if new_count:
+                    self.unigram_counts[word] = new_count
+                    if not old_count:
+                        added_words.append(word)
+                else:
+                    del self.unigram_counts[word]
+                    removed_words.append(word)
+            for bigram, count in bigram_delta.items():
+                new_count = self.bigram_counts.get(bigram, 0) + sign * count
+                if new_count:
+                    self.bigram_counts[bigram] = new_count
+                else:
+                    del self.bigram_counts[bigram]
+            self.total_num_tokens += sign * num_tokens
+            self.version += 1
+
+            if added_words or removed_words:
+                listeners = getattr(self, 'vocabulary_listeners', [])
+                for listener in list(listeners):
+                    listener = listener()
+                    if listener is not None:
+                        listener(added_words, removed_words)
+                listeners[:] = [listener for listener in listeners if listener() is not None]
+        return added_words, removed_words
@@ -0,0 +1,131 @@
+
+
+class LatticeDecoder:
+    """Finds the most likely query Q for a raw query R without materializing
+    every candidate string. R is represented as a lattice over the boundaries
+    between its tokens: each arc replaces one token by one of its candidates
+    from the `CandidateGenerator` (possibly several words, for a split, or
+    none, for a deleted token), or two adjacent tokens by their merge. Viterbi over the bigram `LanguageModel`
+    then finds the path maximizing log P(R|Q) + mu * log P(Q), in time linear
+    in the number of tokens.
+    """
+
+    START = None  # Previous word of the state at the start of the query
+
+    def __init__(self, lm, cg, mu):
+        """
+        Args:
+            lm (LanguageModel): Language model for estimating P(Q).
+            cg (CandidateGenerator): Candidate generator for the terms of R.
+            mu (float): Weighting factor for the language model.
+        """
+        self.lm = lm
+        self.cg = cg
+        self.mu = mu
+
+    def get_arcs_into(self, tokens, end):
+        """Gets the arcs ending at the boundary after token `end - 1`.
+
+        Returns:
+            arcs (list): List of tuples (start, words, edit_logp), where the
+                arc replaces `tokens[start:end]` with the tuple `words`, which
+                is empty for an arc deleting the token. Arcs with OOV words (e.g. digits, which are kept as candidates of
+                themselves) are left out, since the language model cannot
+                score them.
+        """
+        arcs = []
+        for candidate, edit_logp in self.cg.get_candidates_for_term(tokens[end - 1]):
+            words = tuple(candidate.split())
+            if self.cg.get_num_oov(candidate) == 0:
+                arcs.append((end - 1, words, edit_logp))
+
+        if end > 1:
+            merged = tokens[end - 2] + tokens[end - 1]
+            if self.cg.get_num_oov(merged) == 0:
+                original = tokens[end - 2] + ' ' + tokens[end - 1]
+                arcs.append((end - 2, (merged,), self.cg.epm.get_edit_logp(merged, original)))
+        return arcs
+
+    def get_column(self, columns, arcs):
+        """Computes the Viterbi column of a boundary from the columns of earlier
+        boundaries and the arcs into it.
+
+        Args:
+            columns (list of dict): Viterbi columns of the earlier boundaries.
+            arcs (list): Arcs into the boundary, as from `get_arcs_into`.
+
+        Returns:
+            column (dict): Maps the last word of each partial query to a tuple
+                (score, back_pointer), where back_pointer is the tuple
+                (start, previous word, words) of the best arc into the state.
+        """
+        column = {}
+        for start, words, edit_logp in arcs:
+            if not words:
+                # A deleted token leaves the previous word, and the language
+                # model score, as they were
+                for prev_word, (prev_score, _) in columns[start].items():
+                    score = prev_score + edit_logp
+                    best = column.get(prev_word)
+                    if best is None or score > best[0]:
+                        column[prev_word] = (score, (start, prev_word, words))
+                continue
+
+            arc_logp = 0.
+            for w_1, w_2 in zip(words, words[1:]):
+                arc_logp += self.lm.get_bigram_logp(w_1, w_2)
+
+            for prev_word, (prev_score, _) in columns[start].items():
+                if prev_word is self.START:
+                    lm_logp = self.lm.get_unigram_logp(words[0])
+                else:
+                    lm_logp = self.lm.get_bigram_logp(prev_word, words[0])
+                score = prev_score + edit_logp + self.mu * (lm_logp + arc_logp)
+
+                best = column.get(words[-1])
+                if best is None or score > best[0]:
+                    column[words[-1]] = (score, (start, prev_word, words))
+        return column
+
+    def get_best_path(self, columns):
+        """Follows the back pointers from the best state of the last column.
+
+        Returns:
+            path (tuple): Tuple (words, score) of the best query, or None if no
+                path reaches the end of the lattice. Paths deleting every
+                token are left out.
+        """
+        states = [state for state in columns[-1].items() if state[0] is not self.START]
+        if not states:
+            return None
+        word, (score, _) = max(states, key=lambda state: state[1][0])
+
+        words = []
+        end = len(columns) - 1
+        while end > 0:
+            start, prev_word, arc_words = columns[end][word][1]
+            words[:0] = arc_words
+            end, word = start, prev_word
+        return words, score
+
+    def decode(self, tokens):
+        """Runs Viterbi over the lattice of `tokens`.
+
+        Returns:
+            path (tuple): Tuple (words, score) of the best query, or None.
+        """
+        columns = [{self.START: (0., None)}]
+        for end in range(1, len(tokens) + 1):
+            columns.append(self.get_column(columns, self.get_arcs_into(tokens, end)))
+        return self.get_best_path(columns)
+
+    def correct_spelling(self, r):
+        """Corrects spelling of raw query `r`.
+
+        Returns:
+            q (str): Best query in the lattice, or None if the lattice has no
+                complete path (e.g. a term has no in-vocabulary candidates).
+        """
+        tokens = r.split()
+        path = self.decode(tokens) if tokens else None
+        return None if path is None else ' '.join(path[0])
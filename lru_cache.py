@@ -0,0 +1,62 @@
+
+
+class LRUCache:
+    """Size-bounded cache that evicts the least recently used entry once it
+    holds `max_size` entries, and counts its hits, misses and evictions.
+
+    Entries are tied to the state of the models they were computed from: call
+    `validate` with the current state before each lookup, and the cache empties
+    itself whenever that state changes.
+    """
+
+    def __init__(self, max_size):
+        """
+        Args:
+            max_size (int): Maximum number of entries to keep.
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.state = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def validate(self, state):
+        """Clears the cache if `state` differs from the state its entries were
+        computed under."""
+        if state != self.state:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.state = state
+
+    def get(self, key):
+        """Gets the value cached for `key`, or None."""
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """Caches `value` for `key`, evicting the least recently used entry if
+        the cache is full."""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_stats(self):
+        """Gets the size and hit/miss/eviction counters of the cache."""
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.,
+                'evictions': self.evictions, 'invalidations': self.invalidations}
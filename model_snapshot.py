@@ -0,0 +1,291 @@
+
+
+class SnapshotError(ValueError):
+    """Raised when a model snapshot cannot be loaded: it is not a snapshot, it
+    was written by another format version, or it was built from other data."""
+
+
+class ModelSnapshot:
+    """Versioned binary snapshot of a trained model, read through `mmap` so that
+    loading does not copy the count arrays, and every process that loads the
+    same file shares its pages through the OS page cache.
+
+    File layout:
+        MAGIC (8 bytes)
+        header length (uint64, little-endian)
+        header (UTF-8 JSON): format version, model kind, source fingerprint,
+            model metadata, and (offset, length, typecode) of every section
+        sections, each starting at a multiple of 8 bytes
+    """
+
+    MAGIC = b'SPELLSNP'
+    FORMAT_VERSION = 1
+    ALIGNMENT = 8
+
+    def __init__(self, path, source_paths=None, buffer=None):
+        """Opens and validates the snapshot at `path`.
+
+        Args:
+            path (str): Path to the snapshot file, or name of `buffer`.
+            source_paths (list of str): If given, the files the model is
+                expected to have been built from. Loading fails if they
+                changed since the snapshot was written.
+            buffer: Optional buffer already holding the snapshot, such as a
+                shared memory block, read instead of the file at `path`.
+        """
+        self.path = path
+        if buffer is not None:
+            self.buffer = buffer
+        else:
+            with open(path, 'rb') as f:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.buffer[:len(self.MAGIC)] != self.MAGIC:
+            raise SnapshotError('{} is not a model snapshot'.format(path))
+        start = len(self.MAGIC) + 8
+        header_len, = struct.unpack('<Q', self.buffer[len(self.MAGIC):start])
+        self.header = json.loads(bytes(self.buffer[start:start + header_len]).decode('utf-8'))
+
+        if self.header['version'] != self.FORMAT_VERSION:
+            raise SnapshotError('{} has format version {}, expected {}'.format(
+                path, self.header['version'], self.FORMAT_VERSION))
+        if source_paths is not None:
+            fingerprint = get_source_fingerprint(source_paths)
+            if self.header['source'] != fingerprint:
+                raise SnapshotError('{} was built from different source data than the {} '
+                                    'file(s) given'.format(path, len(source_paths)))
+
+    @property
+    def kind(self):
+        return self.header['kind']
+
+    @property
+    def metadata(self):
+        return self.header['metadata']
+
+    def get_section(self, name):
+        """Gets section `name` as a zero-copy memoryview over the mapped file,
+        cast to the typecode it was written with ('B' for raw bytes)."""
+        offset, length, typecode = self.header['sections'][name]
+        return memoryview(self.buffer)[offset:offset + length].cast(typecode)
+
+    @classmethod
+    def write(cls, path, kind, metadata, sections, source_paths=()):
+        """Writes a snapshot.
+
+        Args:
+            path (str): Path to write the snapshot to.
+            kind (str): Name of the model class stored in the snapshot.
+            metadata (dict): JSON-serializable model attributes.
+            sections (dict): Maps section names to `array`s, `bytes`, or
+                other objects supporting the buffer protocol.
+            source_paths (list of str): Files the model was built from.
+        """
+        prefix, offsets, views, _ = cls.get_layout(kind, metadata, sections, source_paths)
+        with open(path, 'wb') as f:
+            f.write(prefix)
+            for name, view in views.items():
+                f.seek(offsets[name])
+                f.write(view)
+
+    @classmethod
+    def write_to_buffer(cls, buffer, kind, metadata, sections, source_paths=()):
+        """Same as `write`, into `buffer` (of at least `get_layout(...)[3]` bytes)."""
+        prefix, offsets, views, _ = cls.get_layout(kind, metadata, sections, source_paths)
+        buffer[:len(prefix)] = prefix
+        for name, view in views.items():
+            buffer[offsets[name]:offsets[name] + view.nbytes] = view.cast('B')
+
+    @classmethod
+    def get_layout(cls, kind, metadata, sections, source_paths=()):
+        """Lays out a snapshot (see `write` for the arguments).
+
+        Returns:
+            prefix (bytes): Magic, header length and header, padded to the
+                start of the first section.
+            offsets (dict): Maps section names to their offsets.
+            views (dict): Maps section names to memoryviews of their data.
+            size (int): Size of the whole snapshot in bytes.
+        """
+        views = {name: memoryview(data) for name, data in sections.items()}
+        layout = {}
+        offset = 0
+        for name, view in views.items():
+            layout[name] = (offset, view.nbytes, view.format)
+            offset += -(-view.nbytes // cls.ALIGNMENT) * cls.ALIGNMENT
+
+        # Grow the space reserved for the header until the header, which
+        # records the absolute section offsets, fits in it
+        data_start = 0
+        while True:
+            header = {'version': cls.FORMAT_VERSION, 'kind': kind,
+                      'source': get_source_fingerprint(source_paths),
+                      'metadata': metadata,
+                      'sections': {name: [data_start + offset, length, typecode]
+                                   for name, (offset, length, typecode) in layout.items()}}
+            header_bytes = json.dumps(header).encode('utf-8')
+            header_end = len(cls.MAGIC) + 8 + len(header_bytes)
+            if header_end <= data_start:
+                break
+            data_start = -(-header_end // cls.ALIGNMENT) * cls.ALIGNMENT
+        header_bytes += b' ' * (data_start - header_end)
+
+        prefix = cls.MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes
+        offsets = {name: section[0] for name, section in header['sections'].items()}
+        return prefix, offsets, views, data_start + offset
+
+
+def get_source_fingerprint(source_paths):
+    """Fingerprints the names, sizes and modification times of `source_paths`."""
+    digest = hashlib.sha1()
+    for path in sorted(source_paths):
+        stat = os.stat(path)
+        digest.update('{}\t{}\t{}\n'.format(os.path.basename(path), stat.st_size,
+                                            stat.st_mtime_ns).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def save_language_model(lm, path, corpus_dir=None):
+    """Saves `lm` to a snapshot at `path`.
+
+    Args:
+        lm (LanguageModel): Language model to save. Counter-based models are
+            compacted first.
+        path (str): Path to write the snapshot to.
+        corpus_dir (str): Corpus `lm` was built from, recorded so that loading
+            can check the snapshot is up to date.
+    """
+    source_paths = glob.glob(os.path.join(corpus_dir, '*.*')) if corpus_dir else ()
+    ModelSnapshot.write(path, 'LanguageModel', *get_language_model_sections(lm),
+                        source_paths=source_paths)
+
+
+def get_language_model_sections(lm):
+    """Gets the snapshot metadata and sections of `lm`, compacted first if it
+    is Counter-based."""
+    if not isinstance(lm, CompactLanguageModel):
+        lm = CompactLanguageModel.from_language_model(lm)
+    words = '\n'.join(lm.words).encode('utf-8')
+    return ({'lambda_': lm.lambda_, 'total_num_tokens': lm.total_num_tokens},
+            {'words': words,
+             'unigram_counts': lm.unigram_counts.counts,
+             'bigram_offsets': lm.bigram_counts.offsets,
+             'bigram_next_ids': lm.bigram_counts.next_ids,
+             'bigram_counts': lm.bigram_counts.counts})
+
+
+def load_language_model(path, corpus_dir=None):
+    """Loads a `CompactLanguageModel` from the snapshot at `path`. The count
+    arrays stay in the mapped file and are only paged in when read.
+
+    Args:
+        path (str): Path to the snapshot.
+        corpus_dir (str): If given, fail unless the snapshot was built from
+            the current contents of this corpus.
+
+    Raises:
+        SnapshotError: If the snapshot is invalid, out of date, or does not
+            contain a language model.
+    """
+    source_paths = glob.glob(os.path.join(corpus_dir, '*.*')) if corpus_dir else None
+    return language_model_from_snapshot(ModelSnapshot(path, source_paths))
+
+
+def language_model_from_snapshot(snapshot, word_ids=None, words=None):
+    """Builds a `CompactLanguageModel` over the sections of `snapshot`.
+
+    Args:
+        snapshot (ModelSnapshot): Snapshot of a language model.
+        word_ids: Optional mapping of words to ids, instead of a dict built
+            from the words of the snapshot.
+        words: Optional sequence of the words by id, to go with `word_ids`.
+    """
+    if snapshot.kind != 'LanguageModel':
+        raise SnapshotError('{} is a snapshot of kind {}, not LanguageModel'.format(
+            snapshot.path, snapshot.kind))
+
+    if word_ids is None:
+        words = bytes(snapshot.get_section('words')).decode('utf-8')
+        words = words.split('\n') if words else []
+        word_ids = {word: word_id for word_id, word in enumerate(words)}
+    lm = CompactLanguageModel.__new__(CompactLanguageModel)
+    lm.lambda_ = snapshot.metadata['lambda_']
+    lm.total_num_tokens = snapshot.metadata['total_num_tokens']
+    lm.set_arrays(word_ids, words,
+                  snapshot.get_section('unigram_counts'),
+                  snapshot.get_section('bigram_offsets'),
+                  snapshot.get_section('bigram_next_ids'),
+                  snapshot.get_section('bigram_counts'))
+    lm.snapshot = snapshot  # Keeps the mapping open for as long as `lm` lives
+    return lm
+
+
+def save_edit_model(epm, path, training_set_path=None):
+    """Saves the counts of an `EmpiricalEditProbabilityModel` to a snapshot.
+
+    Args:
+        epm (EmpiricalEditProbabilityModel): Edit probability model to save.
+        path (str): Path to write the snapshot to.
+        training_set_path (str): Training set `epm` was built from, recorded so
+            that loading can check the snapshot is up to date.
+    """
+    ModelSnapshot.write(path, 'EmpiricalEditProbabilityModel', *get_edit_model_sections(epm),
+                        source_paths=[training_set_path] if training_set_path else ())
+
+
+def get_edit_model_sections(epm, with_tables=False):
+    """Gets the snapshot metadata and sections of `epm`: its counts, and if
+    `with_tables`, its log-probability tables too, so that loading does not
+    have to rebuild them."""
+    counts = {'unigram_counts': list(epm.unigram_counts.items()),
+              'bigram_counts': [[c1, c2, count] for (c1, c2), count in epm.bigram_counts.items()],
+              'edit_counts': {str(edit_type): [[c1, c2, count] for (c1, c2), count in edits.items()]
+                              for edit_type, edits in epm.edit_counts.items()}}
+    metadata = {'alphabet_size': epm.alphabet_size}
+    sections = {'counts': json.dumps(counts).encode('utf-8')}
+    if with_tables:
+        metadata['chars'] = sorted(epm.char_ids, key=epm.char_ids.get)
+        metadata['logp_tables_shape'] = list(epm.logp_tables.shape)
+        sections['logp_tables'] = np.ascontiguousarray(epm.logp_tables, dtype=np.float64)
+    return metadata, sections
+
+
+def load_edit_model(path, training_set_path=None):
+    """Loads an `EmpiricalEditProbabilityModel` from the snapshot at `path`.
+
+    Args:
+        path (str): Path to the snapshot.
+        training_set_path (str): If given, fail unless the snapshot was built
+            from the current contents of this training set.
+
+    Raises:
+        SnapshotError: If the snapshot is invalid, out of date, or does not
+            contain an edit probability model.
+    """
+    return edit_model_from_snapshot(
+        ModelSnapshot(path, [training_set_path] if training_set_path else None))
+
+
+def edit_model_from_snapshot(snapshot):
+    """Builds an `EmpiricalEditProbabilityModel` from the sections of
+    `snapshot`, over its log-probability tables if it has them."""
+    if snapshot.kind != 'EmpiricalEditProbabilityModel':
+        raise SnapshotError('{} is a snapshot of kind {}, not EmpiricalEditProbabilityModel'.format(
+            snapshot.path, snapshot.kind))
+
+    counts = json.loads(bytes(snapshot.get_section('counts')).decode('utf-8'))
+    epm = EmpiricalEditProbabilityModel.__new__(EmpiricalEditProbabilityModel)
+    epm.alphabet_size = snapshot.metadata['alphabet_size']
+    epm.unigram_counts = Counter(dict(counts['unigram_counts']))
+    epm.bigram_counts = Counter({(c1, c2): count for c1, c2, count in counts['bigram_counts']})
+    epm.edit_counts = {int(edit_type): Counter({(c1, c2): count for c1, c2, count in edits})
+                       for edit_type, edits in counts['edit_counts'].items()}
+    if 'logp_tables' in snapshot.header['sections']:
+        epm.char_ids = {c: i for i, c in enumerate(snapshot.metadata['chars'])}
+        epm.logp_tables = np.frombuffer(snapshot.get_section('logp_tables'), dtype=np.float64).reshape(
+            snapshot.metadata['logp_tables_shape'])
+        epm.snapshot = snapshot  # Keeps the tables mapped for as long as `epm` lives
+        epm.version += 1
+    else:
+        epm.build_logp_tables()
+    return epm
@@ -0,0 +1,76 @@
+
+
+class QueryDeltaScorer:
+    """Scores candidate queries by how they differ from a base query. The
+    unigram and bigram log-probabilities of the base query are computed once,
+    with prefix sums over the bigram terms, so scoring a candidate that edits a
+    few terms only computes the bigrams touching its edited spans: its cost does
+    not depend on the length of the query.
+    """
+
+    def __init__(self, lm, tokens):
+        """
+        Args:
+            lm (LanguageModel): Language model for estimating P(Q).
+            tokens (list of str): Terms of the base (raw) query.
+        """
+        self.lm = lm
+        self.tokens = tokens
+
+        # Terms of the base query that are out of vocabulary have no defined
+        # log-probability; candidates always replace them, so they count as 0
+        in_vocab = [token in lm.unigram_counts for token in tokens]
+        self.first_logp = lm.get_unigram_logp(tokens[0]) if tokens and in_vocab[0] else 0.
+        self.bigram_prefix_logps = [0.]  # Sum of bigram terms of tokens[:k + 1]
+        for k in range(1, len(tokens)):
+            logp = 0.
+            if in_vocab[k - 1] and in_vocab[k]:
+                logp = lm.get_bigram_logp(tokens[k - 1], tokens[k])
+            self.bigram_prefix_logps.append(self.bigram_prefix_logps[-1] + logp)
+
+    def get_query_logp(self, spans):
+        """Computes `lm.get_query_logp` of the base query with `spans` applied.
+
+        Args:
+            spans (tuple): Sorted, non-overlapping tuples (start, end, words),
+                each replacing the base terms `start:end` with `words`, as
+                yielded by `CandidateGenerator.get_candidate_edits`.
+
+        Returns:
+            log_p (float): Log-probability of the candidate query, or None if
+                the candidate has no terms.
+        """
+        log_prob = 0.
+        prev_word = None
+        pos = 0
+        for start, end, words in spans + ((len(self.tokens), len(self.tokens), ()),):
+            if pos < start:
+                # Unedited terms pos:start, whose internal bigrams are cached
+                if prev_word is None:
+                    log_prob += self.first_logp if pos == 0 else self.lm.get_unigram_logp(self.tokens[pos])
+                else:
+                    log_prob += self.lm.get_bigram_logp(prev_word, self.tokens[pos])
+                log_prob += self.bigram_prefix_logps[start - 1] - self.bigram_prefix_logps[pos]
+                prev_word = self.tokens[start - 1]
+            for word in words:
+                if prev_word is None:
+                    log_prob += self.lm.get_unigram_logp(word)
+                else:
+                    log_prob += self.lm.get_bigram_logp(prev_word, word)
+                prev_word = word
+            pos = end
+        return None if prev_word is None else log_prob
+
+    def get_query_logp_upper_bound(self, spans):
+        """Gets an upper bound on `get_query_logp(spans)` from the cached terms
+        alone: every log-probability is at most 0, so the log-probability of
+        the unedited terms bounds that of the whole candidate."""
+        log_prob = 0.
+        pos = 0
+        for start, end, _ in spans + ((len(self.tokens), len(self.tokens), ()),):
+            if pos < start:
+                if pos == 0:
+                    log_prob += self.first_logp
+                log_prob += self.bigram_prefix_logps[start - 1] - self.bigram_prefix_logps[pos]
+            pos = end
+        return log_prob
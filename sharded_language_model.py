@@ -0,0 +1,239 @@
+
+
+def get_shard_id(w_1, num_shards):
+    """Gets the shard holding the bigrams that start with `w_1`."""
+    return zlib.crc32(w_1.encode('utf-8')) % num_shards
+
+
+class ShardedBigramCounts(Mapping):
+    """Read-only, Counter-like view of bigram counts partitioned by the hash of
+    w_1 into shard files (see `save_sharded_language_model`). A shard is read
+    into a dict the first time one of its bigrams is looked up, and the least
+    recently used shards are evicted once the loaded shards take more than
+    `memory_budget_bytes`. Missing bigrams have a count of 0.
+
+    Lookups may come from several threads at once, so the loaded shards are
+    guarded by a lock. Shards are read from disk outside of it, so that
+    loading a shard does not hold up lookups in the loaded ones.
+    """
+
+    def __init__(self, directory, num_shards, num_bigrams, memory_budget_bytes=1 << 28,
+                 build_id=None):
+        """
+        Args:
+            directory (str): Directory of the shard files.
+            num_shards (int): Number of shards the bigrams are partitioned in.
+            num_bigrams (int): Total number of bigrams in the shards.
+            memory_budget_bytes (int): Number of bytes the loaded shards may
+                take. The shard being looked up is kept even if it alone
+                exceeds the budget.
+            build_id (str): Id of the `save_sharded_language_model` call
+                that wrote the shards, which every shard must carry.
+        """
+        self.directory = directory
+        self.num_shards = num_shards
+        self.num_bigrams = num_bigrams
+        self.memory_budget_bytes = memory_budget_bytes
+        self.build_id = build_id
+        self.reset()
+
+    def reset(self):
+        """Unloads every shard and resets the statistics."""
+        self.shards = OrderedDict()  # Maps loaded shard ids -> (bigram counts, bytes)
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0         # Lookups whose shard was already loaded
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.
+        self.shard_loads = Counter()  # Maps shard id -> number of times loaded
+
+    def __getstate__(self):
+        # Loaded shards and the lock stay in this process
+        return {'directory': self.directory, 'num_shards': self.num_shards,
+                'num_bigrams': self.num_bigrams, 'memory_budget_bytes': self.memory_budget_bytes,
+                'build_id': self.build_id}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reset()
+
+    def get_shard_path(self, shard_id):
+        return os.path.join(self.directory, 'bigrams-{:05d}.snp'.format(shard_id))
+
+    def read_shard(self, shard_id):
+        """Reads shard `shard_id` from disk into a dict of bigram counts.
+
+        Returns:
+            counts (dict): Maps tuples (w_1, w_2) -> count(w_1, w_2).
+            nbytes (int): Estimate of the bytes taken by `counts`, from the
+                sizes of its entries and the lengths of their words.
+
+        Raises:
+            SnapshotError: If the file is not shard `shard_id` of the same
+                build as the unigram counts, e.g. in a partially rewritten
+                directory.
+        """
+        snapshot = ModelSnapshot(self.get_shard_path(shard_id))
+        if snapshot.kind != 'BigramShard':
+            raise SnapshotError('{} is a snapshot of kind {}, not BigramShard'.format(
+                snapshot.path, snapshot.kind))
+        metadata = snapshot.metadata
+        if (metadata.get('build_id') != self.build_id or metadata['shard_id'] != shard_id
+                or metadata['num_shards'] != self.num_shards):
+            raise SnapshotError('{} was not written with the unigram counts of {}'.format(
+                snapshot.path, self.directory))
+        words_1 = bytes(snapshot.get_section('words_1')).decode('utf-8')
+        words_2 = bytes(snapshot.get_section('words_2')).decode('utf-8')
+        if not words_1:
+            return {}, sys.getsizeof({})
+        counts = dict(zip(zip(words_1.split('\n'), words_2.split('\n')),
+                          snapshot.get_section('counts').tolist()))
+        entry_bytes = sys.getsizeof(('', '')) + 2 * sys.getsizeof('') + sys.getsizeof(1)
+        return counts, sys.getsizeof(counts) + len(counts) * entry_bytes + len(words_1) + len(words_2)
+
+    def get_shard(self, shard_id):
+        """Gets the bigram counts of shard `shard_id`, loading it if needed."""
+        with self.lock:
+            self.lookups += 1
+            shard = self.shards.get(shard_id)
+            if shard is not None:
+                self.hits += 1
+                self.shards.move_to_end(shard_id)
+                return shard[0]
+
+        start = time.perf_counter()
+        counts, nbytes = self.read_shard(shard_id)
+        seconds = time.perf_counter() - start
+
+        with self.lock:
+            self.load_seconds += seconds
+            self.loads += 1
+            self.shard_loads[shard_id] += 1
+            shard = self.shards.get(shard_id)
+            if shard is not None:
+                # Another thread loaded it in the meantime: keep that copy
+                self.shards.move_to_end(shard_id)
+                return shard[0]
+
+            self.shards[shard_id] = (counts, nbytes)
+            self.memory_bytes += nbytes
+            while self.memory_bytes > self.memory_budget_bytes and len(self.shards) > 1:
+                _, (_, evicted_bytes) = self.shards.popitem(last=False)
+                self.memory_bytes -= evicted_bytes
+                self.evictions += 1
+            return counts
+
+    def __getitem__(self, bigram):
+        return self.get_shard(get_shard_id(bigram[0], self.num_shards)).get(bigram, 0)
+
+    def __contains__(self, bigram):
+        return bigram in self.get_shard(get_shard_id(bigram[0], self.num_shards))
+
+    def __iter__(self):
+        # Reads every shard without loading it, so iterating does not evict
+        for shard_id in range(self.num_shards):
+            yield from self.read_shard(shard_id)[0]
+
+    def __len__(self):
+        return self.num_bigrams
+
+    def get_stats(self):
+        """Gets the shard hit, load and eviction counters, to size the budget."""
+        return {'num_shards': self.num_shards, 'loaded_shards': len(self.shards),
+                'memory_bytes': self.memory_bytes, 'memory_budget_bytes': self.memory_budget_bytes,
+                'lookups': self.lookups, 'hits': self.hits,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0.,
+                'loads': self.loads, 'evictions': self.evictions,
+                'load_seconds': self.load_seconds,
+                'distinct_shards_loaded': len(self.shard_loads),
+                'reloads': self.loads - len(self.shard_loads)}
+
+
+class ShardedLanguageModel(LanguageModel):
+    """`LanguageModel` that keeps its unigram counts in memory, but reads its
+    bigram counts from shard files on disk as they are needed, through
+    `ShardedBigramCounts`. `get_bigram_logp` and `get_query_logp` work
+    unchanged. Saved with `save_sharded_language_model`.
+    """
+
+    def __init__(self, directory, memory_budget_bytes=1 << 28, corpus_dir=None):
+        """
+        Args:
+            directory (str): Directory written by `save_sharded_language_model`.
+            memory_budget_bytes (int): Number of bytes the loaded bigram
+                shards may take.
+            corpus_dir (str): If given, fail unless the model was built from
+                the current contents of this corpus.
+
+        Raises:
+            SnapshotError: If the directory does not hold a valid, up-to-date
+                sharded language model.
+        """
+        source_paths = glob.glob(os.path.join(corpus_dir, '*.*')) if corpus_dir else None
+        snapshot = ModelSnapshot(os.path.join(directory, 'unigrams.snp'), source_paths)
+        if snapshot.kind != 'ShardedLanguageModel':
+            raise SnapshotError('{} is a snapshot of kind {}, not ShardedLanguageModel'.format(
+                snapshot.path, snapshot.kind))
+
+        metadata = snapshot.metadata
+        words = bytes(snapshot.get_section('words')).decode('utf-8')
+        words = words.split('\n') if words else []
+        self.lambda_ = metadata['lambda_']
+        self.total_num_tokens = metadata['total_num_tokens']
+        self.unigram_counts = Counter(dict(zip(words, snapshot.get_section('unigram_counts').tolist())))
+        self.bigram_counts = ShardedBigramCounts(directory, metadata['num_shards'],
+                                                 metadata['num_bigrams'], memory_budget_bytes,
+                                                 metadata.get('build_id'))
+        self.version += 1
+
+    def apply_counts_delta(self, partial_counts, sign):
+        raise TypeError('ShardedLanguageModel counts are read-only; update a LanguageModel '
+                        'and save it again with `save_sharded_language_model`')
+
+    def get_shard_stats(self):
+        return self.bigram_counts.get_stats()
+
+
+def save_sharded_language_model(lm, directory, num_shards=64, corpus_dir=None):
+    """Saves `lm` as a `ShardedLanguageModel` in `directory`: its unigram
+    counts in one snapshot, and its bigram counts partitioned by the CRC32 of
+    w_1 into `num_shards` shard snapshots. Every snapshot records a random
+    id of this call, so that shards of another call are not loaded with it.
+
+    Args:
+        lm (LanguageModel): Language model to save.
+        directory (str): Directory to write the snapshots to. Created if it
+            does not exist.
+        num_shards (int): Number of bigram shards.
+        corpus_dir (str): Corpus `lm` was built from, recorded so that loading
+            can check the model is up to date.
+    """
+    os.makedirs(directory, exist_ok=True)
+    source_paths = glob.glob(os.path.join(corpus_dir, '*.*')) if corpus_dir else ()
+
+    shards = [[] for _ in range(num_shards)]
+    num_bigrams = 0
+    for (w_1, w_2), count in lm.bigram_counts.items():
+        shards[get_shard_id(w_1, num_shards)].append((w_1, w_2, count))
+        num_bigrams += 1
+
+    build_id = os.urandom(8).hex()
+    bigram_counts = ShardedBigramCounts(directory, num_shards, num_bigrams, build_id=build_id)
+    for shard_id, bigrams in enumerate(shards):
+        bigrams.sort()
+        ModelSnapshot.write(bigram_counts.get_shard_path(shard_id), 'BigramShard',
+                            {'shard_id': shard_id, 'num_shards': num_shards, 'build_id': build_id},
+                            {'words_1': '\n'.join(w_1 for w_1, _, _ in bigrams).encode('utf-8'),
+                             'words_2': '\n'.join(w_2 for _, w_2, _ in bigrams).encode('utf-8'),
+                             'counts': array('q', (count for _, _, count in bigrams))})
+
+    words = sorted(lm.unigram_counts)
+    ModelSnapshot.write(os.path.join(directory, 'unigrams.snp'), 'ShardedLanguageModel',
+                        {'lambda_': lm.lambda_, 'total_num_tokens': lm.total_num_tokens,
+                         'num_shards': num_shards, 'num_bigrams': num_bigrams,
+                         'build_id': build_id},
+                        {'words': '\n'.join(words).encode('utf-8'),
+                         'unigram_counts': array('q', (lm.unigram_counts[word] for word in words))},
+                        source_paths)
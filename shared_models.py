@@ -0,0 +1,256 @@
+
+
+def get_word_hash(word_bytes):
+    """Stable hash of a UTF-8 encoded word, the same in every process."""
+    return zlib.crc32(word_bytes)
+
+
+class SharedWords(Sequence):
+    """Read-only list of the words of a vocabulary, decoded on access from a
+    blob of UTF-8 words and their offsets, both in shared memory."""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob        # Concatenated UTF-8 words
+        self.offsets = offsets  # Word i is blob[offsets[i]:offsets[i + 1]]
+
+    def get_bytes(self, word_id):
+        return self.blob[self.offsets[word_id]:self.offsets[word_id + 1]]
+
+    def __getitem__(self, word_id):
+        if isinstance(word_id, slice):
+            return [self[i] for i in range(*word_id.indices(len(self)))]
+        return bytes(self.get_bytes(word_id)).decode('utf-8')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+class SharedVocabulary(Mapping):
+    """Read-only mapping of words to ids, as an open-addressing hash table of
+    word ids (with linear probing, -1 for empty slots) over `SharedWords`, so
+    that it lives in shared memory instead of a dict in every process. The
+    table is at most half full, so most missing words, which the candidate
+    generator looks up far more often than present ones, stop at the first
+    slot."""
+
+    def __init__(self, words, table):
+        """
+        Args:
+            words (SharedWords): Words by id.
+            table: Hash table of word ids; its length is a power of two.
+        """
+        self.words = words
+        self.table = table
+        self.mask = len(table) - 1
+
+    @staticmethod
+    def build_table(words):
+        """Builds the hash table of `words` (a list of str), with at least
+        twice as many slots as words.
+
+        Returns:
+            blob (bytes), offsets (array), table (array): Sections for
+                `SharedWords` and `SharedVocabulary`.
+        """
+        encoded = [word.encode('utf-8') for word in words]
+        offsets = array('q', [0])
+        for word_bytes in encoded:
+            offsets.append(offsets[-1] + len(word_bytes))
+
+        num_slots = 1
+        while num_slots < 2 * len(words):
+            num_slots *= 2
+        mask = num_slots - 1
+        table = array('i', [-1]) * num_slots
+        for word_id, word_bytes in enumerate(encoded):
+            slot = get_word_hash(word_bytes) & mask
+            while table[slot] != -1:
+                slot = (slot + 1) & mask
+            table[slot] = word_id
+        return b''.join(encoded), offsets, table
+
+    def get(self, word, default=None):
+        word_bytes = word.encode('utf-8')
+        table, mask = self.table, self.mask
+        slot = zlib.crc32(word_bytes) & mask  # Same as `get_word_hash`, inlined
+        word_id = table[slot]
+        while word_id != -1:
+            if self.words.get_bytes(word_id) == word_bytes:
+                return word_id
+            slot = (slot + 1) & mask
+            word_id = table[slot]
+        return default
+
+    def __getitem__(self, word):
+        word_id = self.get(word)
+        if word_id is None:
+            raise KeyError(word)
+        return word_id
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __len__(self):
+        return len(self.words)
+
+
+class SharedModels:
+    """Publishes a language model and an edit probability model in
+    `multiprocessing.shared_memory` blocks, laid out as `ModelSnapshot`s, so
+    that worker processes attach to one copy of the count tables instead of
+    each building or unpickling its own. The vocabulary is shared too, as a
+    `SharedVocabulary`, and so are the edit log-probability tables.
+
+    Attaching only maps the blocks and parses their headers, and the counts
+    are never written to, so no page is copied into a worker: total memory
+    stays about constant as workers are added. Lookups in a
+    `SharedVocabulary` cost more than in a dict, in exchange: pass
+    `shared_vocabulary=False` to trade a dict of the vocabulary per worker for
+    faster candidate generation.
+
+    The process that creates the blocks owns them: use it as a context
+    manager, or call `close`, to free them once the workers are done. A
+    process that attaches to them with `attach_shared_models` can unmap them
+    with `detach_shared_models`.
+
+    Example:
+        >>> with SharedModels(lm, epm) as shared:
+        ...     cs.correct_spelling_batch(queries, workers=8,
+        ...                               scorer_factory=shared.get_scorer_factory())
+    """
+
+    def __init__(self, lm, epm):
+        """
+        Args:
+            lm (LanguageModel): Language model to share. Counter-based models
+                are compacted first.
+            epm (EmpiricalEditProbabilityModel): Edit probability model to share.
+        """
+        metadata, sections = get_language_model_sections(lm)
+        words = bytes(memoryview(sections['words'])).decode('utf-8')
+        blob, offsets, table = SharedVocabulary.build_table(words.split('\n') if words else [])
+        sections.update({'word_blob': blob, 'word_offsets': offsets, 'word_table': table})
+
+        self.blocks = {}
+        try:
+            self.blocks['lm'] = self.create_block('LanguageModel', metadata, sections)
+            self.blocks['epm'] = self.create_block('EmpiricalEditProbabilityModel',
+                                                   *get_edit_model_sections(epm, with_tables=True))
+        except BaseException:
+            self.close()
+            raise
+        self.handle = {name: block.name for name, block in self.blocks.items()}
+
+    @staticmethod
+    def create_block(kind, metadata, sections):
+        """Creates a shared memory block holding a snapshot of `sections`."""
+        _, _, _, size = ModelSnapshot.get_layout(kind, metadata, sections)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        ModelSnapshot.write_to_buffer(block.buf, kind, metadata, sections)
+        return block
+
+    def get_nbytes(self):
+        """Gets the number of bytes of the shared memory blocks."""
+        return sum(block.size for block in self.blocks.values())
+
+    def get_scorer_factory(self, shared_vocabulary=True, **scorer_kwargs):
+        """Gets a picklable factory of scorers over the shared models, for the
+        `scorer_factory` of `correct_spelling_batch` or `SpellingServer`."""
+        return SharedScorerFactory(self.handle, shared_vocabulary, **scorer_kwargs)
+
+    def close(self):
+        """Frees the shared memory blocks."""
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AttachedSharedMemory(shared_memory.SharedMemory):
+    """`SharedMemory` block attached to by a process that does not own it.
+
+    Models keep zero-copy views of the block, which cannot be closed while
+    they exist. When the block is garbage collected before them, as happens
+    at interpreter exit, it is left mapped for the OS to reclaim rather than
+    failing to close; `detach_shared_models` closes it properly.
+    """
+
+    def __del__(self):
+        try:
+            self.close()
+        except BufferError:
+            pass
+
+
+def attach_shared_block(name):
+    """Attaches to the shared memory block `name` as a `ModelSnapshot`."""
+    block = AttachedSharedMemory(name=name)
+    snapshot = ModelSnapshot(name, buffer=block.buf)
+    snapshot.block = block  # Keeps the block mapped for as long as the snapshot lives
+    return snapshot
+
+
+def attach_shared_models(handle, shared_vocabulary=True):
+    """Attaches read-only to models published by `SharedModels`.
+
+    Args:
+        handle (dict): `SharedModels.handle`, mapping 'lm' and 'epm' to the
+            names of their shared memory blocks.
+        shared_vocabulary (bool): Whether to look words up in the shared
+            `SharedVocabulary`, or in a dict built in this process.
+
+    Returns:
+        lm (CompactLanguageModel): Language model over the shared counts.
+        epm (EmpiricalEditProbabilityModel): Edit probability model over the
+            shared log-probability tables.
+    """
+    snapshot = attach_shared_block(handle['lm'])
+    if shared_vocabulary:
+        words = SharedWords(snapshot.get_section('word_blob'), snapshot.get_section('word_offsets'))
+        lm = language_model_from_snapshot(
+            snapshot, SharedVocabulary(words, snapshot.get_section('word_table')), words)
+    else:
+        lm = language_model_from_snapshot(snapshot)
+    epm = edit_model_from_snapshot(attach_shared_block(handle['epm']))
+    return lm, epm
+
+
+def detach_shared_models(lm, epm):
+    """Releases the views that models from `attach_shared_models` hold on
+    their shared memory blocks, then closes the blocks. The models cannot be
+    used afterwards, and nothing else may still reference their arrays, such
+    as the `LanguageModelArrays` of a scorer: drop the scorers first.
+
+    Raises:
+        BufferError: If views of a block are still referenced elsewhere. The
+            block then stays mapped.
+    """
+    snapshots = [model.snapshot for model in (lm, epm) if hasattr(model, 'snapshot')]
+    for model in (lm, epm):
+        vars(model).clear()  # Drops every view of the blocks the models hold
+    for snapshot in snapshots:
+        snapshot.buffer = None
+        snapshot.block.close()
+
+
+class SharedScorerFactory:
+    """Picklable function building a `CandidateScorer` over the models of a
+    `SharedModels` handle, attached once per process."""
+
+    def __init__(self, handle, shared_vocabulary=True, **scorer_kwargs):
+        self.handle = handle
+        self.shared_vocabulary = shared_vocabulary
+        self.scorer_kwargs = scorer_kwargs
+
+    def __call__(self):
+        lm, epm = attach_shared_models(self.handle, self.shared_vocabulary)
+        return CandidateScorer(lm, CandidateGenerator(lm, epm), **self.scorer_kwargs)
@@ -0,0 +1,246 @@
+
+
+class CountMinSketch:
+    """Count-min sketch: approximate counts of string keys in a fixed-size
+    table of `depth` rows of `width` counters. Each key is counted in one
+    counter per row, chosen by a per-row hash, and its estimate is the
+    minimum over its counters. Estimates never undercount; with conservative
+    update, a counter is only raised as far as the new minimum requires,
+    which greatly reduces overcounting.
+    """
+
+    def __init__(self, width, depth=4, conservative=True, dtype=np.uint32):
+        """
+        Args:
+            width (int): Number of counters per row.
+            depth (int): Number of rows (hash functions).
+            conservative (bool): Whether to use conservative update.
+            dtype: NumPy integer type of the counters.
+        """
+        self.width = width
+        self.depth = depth
+        self.conservative = conservative
+        self.table = np.zeros((depth, width), dtype=dtype)
+        self.rows = np.arange(depth)
+
+    @classmethod
+    def from_memory_budget(cls, budget_bytes, depth=4, conservative=True, dtype=np.uint32):
+        """Builds the widest sketch whose table fits in `budget_bytes`."""
+        width = max(1, budget_bytes // (depth * np.dtype(dtype).itemsize))
+        return cls(width, depth, conservative, dtype)
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def get_columns(self, key):
+        """Gets the counter of `key` in each row, by double hashing one stable
+        128-bit hash (so that a pickled sketch gives the same answers in every
+        process, unlike `hash`)."""
+        h1, h2 = struct.unpack('<QQ', hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest())
+        h2 |= 1
+        return [((h1 + row * h2) & 0xFFFFFFFFFFFFFFFF) % self.width for row in range(self.depth)]
+
+    def get_columns_batch(self, keys):
+        """Same as `get_columns` for every key in `keys` at once.
+
+        Returns:
+            columns (np.ndarray): Array of shape (depth, len(keys)).
+        """
+        digests = b''.join(hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+                           for key in keys)
+        hashes = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+        h1, h2 = hashes[:, 0], hashes[:, 1] | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((h1[None, :] + rows * h2[None, :]) % np.uint64(self.width)).astype(np.intp)
+
+    def add(self, key, count=1):
+        """Adds `count` occurrences of `key`."""
+        self.add_batch([key], [count])
+
+    def add_batch(self, keys, counts):
+        """Adds counts[i] occurrences of keys[i] for every i. The keys must be
+        distinct. With conservative update, every counter of a key is raised
+        to at least the key's previous estimate plus its count, so estimates
+        still never undercount when keys of the batch share counters.
+
+        Returns:
+            estimates (np.ndarray): New estimate of each key.
+        """
+        columns = self.get_columns_batch(keys)
+        counts = np.asarray(counts, dtype=self.table.dtype)
+        if self.conservative:
+            targets = self.table[self.rows[:, None], columns].min(axis=0) + counts
+        for row in range(self.depth):
+            if self.conservative:
+                np.maximum.at(self.table[row], columns[row], targets)
+            else:
+                np.add.at(self.table[row], columns[row], counts)
+        return self.table[self.rows[:, None], columns].min(axis=0)
+
+    def estimate(self, key):
+        """Gets the estimated count of `key`, which is never below its true count."""
+        table = self.table
+        return int(min(table[row, column] for row, column in enumerate(self.get_columns(key))))
+
+
+class SketchBigramCounts(Mapping):
+    """Read-only, Counter-like view of approximate bigram counts: exact counts
+    for the heavy-hitter bigrams, and count-min sketch estimates for the rest,
+    capped at min(count(w_1), count(w_2)), which no bigram count can exceed.
+    Missing bigrams (usually) have a count of 0.
+
+    Only the heavy hitters are stored as keys, so iterating (and `len`) only
+    covers them.
+    """
+
+    def __init__(self, sketch, heavy_hitters, unigram_counts):
+        self.sketch = sketch
+        self.heavy_hitters = heavy_hitters  # Maps tuples (w_1, w_2) -> exact count
+        self.unigram_counts = unigram_counts
+
+    def __getitem__(self, bigram):
+        count = self.heavy_hitters.get(bigram)
+        if count is not None:
+            return count
+        w_1, w_2 = bigram
+        cap = min(self.unigram_counts.get(w_1, 0), self.unigram_counts.get(w_2, 0))
+        if cap == 0:
+            return 0
+        return min(self.sketch.estimate(w_1 + ' ' + w_2), cap)
+
+    def __contains__(self, bigram):
+        return self[bigram] > 0
+
+    def __iter__(self):
+        return iter(self.heavy_hitters)
+
+    def __len__(self):
+        return len(self.heavy_hitters)
+
+
+class SketchLanguageModel(LanguageModel):
+    """`LanguageModel` whose bigram counts live in a `CountMinSketch` of bounded
+    size, with exact counts kept only for the most frequent bigrams, for
+    corpora whose exact bigram counts do not fit in memory. Unigram counts
+    stay exact, since the vocabulary decides which candidates are OOV.
+    `get_bigram_logp` and its lambda interpolation work unchanged on the
+    approximate counts.
+    """
+
+    def __init__(self, corpus_dir='pa2-data/corpus', lambda_=0.05, memory_budget_bytes=1 << 24,
+                 num_heavy_hitters=10000, depth=4, chunk_size=1 << 20):
+        """Counts the corpus in two streaming passes: the first counts the
+        unigrams exactly and the bigrams into the sketch, while tracking the
+        bigrams with the largest estimates; the second counts those exactly.
+        Only the bigrams of one chunk are held exactly at a time. Like
+        `LanguageModel.from_corpus`, bigrams never span two files.
+
+        Args:
+            corpus_dir (str): Path to directory containing corpus.
+            lambda_ (float): Interpolation factor for smoothing by unigram-bigram
+                interpolation.
+            memory_budget_bytes (int): Size of the sketch table.
+            num_heavy_hitters (int): Number of bigrams to count exactly.
+            depth (int): Number of rows of the sketch.
+            chunk_size (int): Number of bytes read from a file at a time.
+        """
+        self.lambda_ = lambda_
+        self.total_num_tokens = 0
+        self.unigram_counts = Counter()
+        self.sketch = CountMinSketch.from_memory_budget(memory_budget_bytes, depth)
+
+        files = sorted(glob.glob(os.path.join(corpus_dir, '*.*')))
+        candidates = {}  # Maps likely heavy-hitter bigrams -> latest estimate
+        for filename in tqdm(files):
+            last_token = None  # Carried over, so that bigrams across chunks count too
+            for tokens in read_token_chunks(filename, chunk_size):
+                self.unigram_counts.update(tokens)
+                self.total_num_tokens += len(tokens)
+                if last_token is not None:
+                    tokens = [last_token] + tokens
+                last_token = tokens[-1]
+                bigram_counts = Counter(zip(tokens, tokens[1:]))
+                if not bigram_counts:
+                    continue
+                bigrams = list(bigram_counts)
+                estimates = self.sketch.add_batch([w_1 + ' ' + w_2 for w_1, w_2 in bigrams],
+                                                  list(bigram_counts.values()))
+                if num_heavy_hitters:
+                    top = np.argsort(-estimates.astype(np.int64),
+                                     kind='stable')[:num_heavy_hitters]
+                    candidates.update((bigrams[i], int(estimates[i])) for i in top)
+                    if len(candidates) > 2 * num_heavy_hitters:
+                        candidates = dict(heapq.nlargest(num_heavy_hitters, candidates.items(),
+                                                         key=lambda candidate: candidate[1]))
+
+        # Second pass: exact counts of the candidates, keeping the largest
+        heavy_hitters = {}
+        if num_heavy_hitters:
+            exact_counts = Counter()
+            for filename in files:
+                last_token = None  # Carried over, so that bigrams across chunks count too
+                for tokens in read_token_chunks(filename, chunk_size):
+                    if last_token is not None:
+                        tokens = [last_token] + tokens
+                    exact_counts.update(bigram for bigram in zip(tokens, tokens[1:])
+                                        if bigram in candidates)
+                    last_token = tokens[-1]
+            heavy_hitters = dict(exact_counts.most_common(num_heavy_hitters))
+
+        self.bigram_counts = SketchBigramCounts(self.sketch, heavy_hitters, self.unigram_counts)
+        self.version += 1
+
+    def apply_counts_delta(self, partial_counts, sign):
+        raise TypeError('SketchLanguageModel bigram counts are read-only')
+
+    def get_memory_footprint(self):
+        """Gets the number of bytes taken by the count storage of this model."""
+        return (get_deep_size(self.unigram_counts, self.bigram_counts.heavy_hitters)
+                + self.sketch.nbytes)
+
+
+def load_dev_set(queries_path='pa2-data/dev_set/queries.txt',
+                 gold_path='pa2-data/dev_set/gold.txt'):
+    """Loads the dev set as a list of (raw query, intended query) pairs."""
+    with open(queries_path) as f_queries, open(gold_path) as f_gold:
+        return [(raw.strip(), gold.strip()) for raw, gold in zip(f_queries, f_gold)]
+
+
+def measure_accuracy_vs_memory(corpus_dir, epm, dev_set, memory_budgets,
+                               num_heavy_hitters=10000, lambda_=0.05):
+    """Measures how correction accuracy on `dev_set` trades off against
+    memory, for an exact `LanguageModel` and a `SketchLanguageModel` per
+    memory budget.
+
+    Args:
+        corpus_dir (str): Path to directory containing corpus.
+        epm (EditProbabilityModel): Edit probability model for every scorer.
+        dev_set (list): Tuples (raw query, intended query), e.g. from
+            `load_dev_set`.
+        memory_budgets (list of int): Sketch sizes to try, in bytes.
+        num_heavy_hitters (int): Number of bigrams each sketch model counts
+            exactly.
+        lambda_ (float): Interpolation factor of every model.
+
+    Returns:
+        results (list of dict): Per model, its memory budget (None for the
+            exact model), the bytes taken by its counts, and its accuracy.
+    """
+    def get_accuracy(lm):
+        cs = CandidateScorer(lm, CandidateGenerator(lm, epm))
+        return sum(cs.correct_spelling(raw) == gold for raw, gold in dev_set) / len(dev_set)
+
+    exact_lm = LanguageModel.from_corpus(corpus_dir, lambda_, workers=1)
+    results = [{'memory_budget_bytes': None, 'memory_bytes': get_memory_footprint(exact_lm),
+                'accuracy': get_accuracy(exact_lm)}]
+    for budget in memory_budgets:
+        lm = SketchLanguageModel(corpus_dir, lambda_, budget, num_heavy_hitters)
+        results.append({'memory_budget_bytes': budget, 'memory_bytes': lm.get_memory_footprint(),
+                        'accuracy': get_accuracy(lm)})
+
+    print('{:>14} {:>14} {:>9}'.format('budget', 'bytes', 'accuracy'))
+    for result in results:
+        print('{:>14} {:>14,} {:>9.2%}'.format(result['memory_budget_bytes'] or 'exact',
+                                               result['memory_bytes'], result['accuracy']))
+    return results
@@ -0,0 +1,322 @@
+"""Command-line spelling correction of query logs.
+
+Streams raw queries, one per line, from files or stdin, and writes their
+corrections to stdout in the same order. Queries are read lazily and corrected
+in chunks by a pool of worker processes, with at most `--window` chunks in
+flight, so inputs much larger than memory stream through in constant memory.
+
+Examples:
+    python spell_correct.py queries.txt > corrections.txt
+    python spell_correct.py --lm-snapshot lm.snp --epm-snapshot epm.snp \\
+        --workers 8 --top-k 3 --format jsonl < queries.txt
+"""
+import os
+import sys
+
+# Cells defining the models, in the order the notebook runs them
+CELLS = ['imports.py', 'language_model_part1.py', 'language_model_part2.py',
+         'base_edit_probability_model.py', 'uniform_edit_probability_model.py',
+         'empirical_edit_probability_model.py', 'candidate_generator.py', 'candidate_scorer.py',
+         'edit_distance.py', 'symmetric_delete_index.py', 'vocabulary_trie.py',
+         'compact_language_model.py', 'model_snapshot.py', 'lru_cache.py', 'lattice_decoder.py',
+         'query_delta_scorer.py', 'spelling_server.py', 'sketch_language_model.py',
+         'word_segmenter.py', 'batch_scorer.py', 'sharded_language_model.py', 'shared_models.py']
+
+
+def load_cells(namespace, cells=CELLS, directory=os.path.dirname(os.path.abspath(__file__))):
+    """Runs `cells` in order in `namespace`, as the notebook would."""
+    for cell in cells:
+        path = os.path.join(directory, cell)
+        with open(path) as f:
+            exec(compile(f.read(), path, 'exec'), namespace)
+
+
+load_cells(globals())
+
+
+def read_queries(paths):
+    """Lazily yields the queries of the files at `paths` ('-' for stdin),
+    one per line, without their line endings."""
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            for line in f:
+                yield line.rstrip('\r\n')
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def read_chunks(queries, chunk_size):
+    """Groups the `queries` iterator into lists of `chunk_size` queries."""
+    chunk = []
+    for query in queries:
+        chunk.append(query)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def correct_chunk(scorer, queries, k=1, deadline_ms=None, with_scores=False):
+    """Corrects each of `queries` with `scorer`, so that one failing query does
+    not fail the rest of its chunk.
+
+    Args:
+        scorer (CandidateScorer): Scorer to correct the queries with.
+        queries (list of str): Raw queries.
+        k (int): Number of scored corrections to get per query. If 1 and no
+            deadline is given, `correct_spelling` is used and no score, unless
+            `with_scores` is set.
+        deadline_ms (float): Optional time budget per query.
+        with_scores (bool): Whether to score the correction when `k` is 1.
+
+    Returns:
+        results (list): Tuples (corrections, completed, error) in the order of
+            `queries`, where corrections is a list of tuples (q, score) (score
+            None when not computed), completed is False if the deadline cut
+            the search short, and error is None or the message of the
+            exception raised.
+    """
+    results = []
+    for query in queries:
+        try:
+            if deadline_ms is not None:
+                # Best correction found by the deadline, without its score
+                correction, completed = scorer.correct_spelling(query, deadline_ms=deadline_ms)
+                results.append(([(correction, None)], completed, None))
+            elif k == 1 and not with_scores:
+                results.append(([(scorer.correct_spelling(query), None)], True, None))
+            else:
+                results.append((scorer.correct_spelling_topk(query, k) or [(query, None)], True, None))
+        except Exception as e:
+            results.append(([(query, None)], True, repr(e)))
+    return results
+
+
+def correct_chunk_in_worker(queries, k=1, deadline_ms=None, with_scores=False):
+    """Same as `correct_chunk` with the scorer of the current worker process
+    (see `init_correction_worker`)."""
+    return correct_chunk(worker_scorer, queries, k, deadline_ms, with_scores)
+
+
+def format_result(query, result, output_format, with_scores):
+    """Formats the corrections of `query` as one output line."""
+    corrections, completed, error = result
+    if output_format == 'jsonl':
+        record = {'query': query, 'correction': corrections[0][0]}
+        if with_scores:
+            record['corrections'] = corrections
+        if not completed:
+            record['completed'] = False
+        if error is not None:
+            record['error'] = error
+        return json.dumps(record)
+    if with_scores:
+        return '\t'.join('{}\t{!r}'.format(q, score) for q, score in corrections)
+    return corrections[0][0]
+
+
+def correct_stream(queries, out, scorer, workers=1, chunk_size=64, window=None, k=1,
+                   deadline_ms=None, output_format='text', with_scores=False,
+                   scorer_factory=None, progress_seconds=None, log=sys.stderr):
+    """Corrects the `queries` iterator, writing one line per query to `out` in
+    input order.
+
+    Args:
+        queries (iterable of str): Raw queries, consumed lazily.
+        out (file): Text stream to write the corrections to.
+        scorer (CandidateScorer): Scorer to correct the queries with.
+        workers (int): Number of worker processes; 1 corrects in this process.
+        chunk_size (int): Number of queries sent to a worker at a time.
+        window (int): Maximum number of chunks in flight. Defaults to twice
+            the number of workers, which bounds memory whatever the input size.
+        k (int): Number of scored corrections per query.
+        deadline_ms (float): Optional time budget per query.
+        output_format (str): 'text' or 'jsonl'.
+        with_scores (bool): Whether to output the corrections with their scores.
+        scorer_factory (callable): Optional function building the scorer of
+            each worker (see `correct_spelling_batch`).
+        progress_seconds (float): If given, report progress to `log` at this
+            interval.
+        log (file): Text stream for progress and statistics.
+
+    Returns:
+        stats (dict): Numbers of queries, errors and incomplete searches,
+            elapsed seconds and queries per second.
+    """
+    window = window or 2 * workers
+    stats = {'queries': 0, 'errors': 0, 'incomplete': 0}
+    start = last_report = time.perf_counter()
+
+    def write(chunk, results):
+        nonlocal last_report
+        out.write(''.join(format_result(query, result, output_format, with_scores) + '\n'
+                          for query, result in zip(chunk, results)))
+        stats['queries'] += len(chunk)
+        stats['errors'] += sum(result[2] is not None for result in results)
+        stats['incomplete'] += sum(not result[1] for result in results)
+        now = time.perf_counter()
+        if progress_seconds is not None and now - last_report >= progress_seconds:
+            last_report = now
+            print('{:,} queries, {:.1f} queries/s'.format(stats['queries'],
+                                                        stats['queries'] / (now - start)),
+                  file=log, flush=True)
+
+    chunks = read_chunks(queries, chunk_size)
+    if workers == 1:
+        for chunk in chunks:
+            write(chunk, correct_chunk(scorer, chunk, k, deadline_ms, with_scores))
+    else:
+        in_flight = deque()  # Tuples (chunk, future), in input order
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_correction_worker,
+                                 initargs=(scorer_factory or scorer,)) as executor:
+            for chunk in chunks:
+                if len(in_flight) >= window:
+                    done_chunk, future = in_flight.popleft()
+                    write(done_chunk, future.result())
+                in_flight.append((chunk, executor.submit(correct_chunk_in_worker, chunk,
+                                                         k, deadline_ms, with_scores)))
+            while in_flight:
+                done_chunk, future = in_flight.popleft()
+                write(done_chunk, future.result())
+    out.flush()
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['queries_per_second'] = stats['queries'] / stats['seconds'] if stats['seconds'] else 0.
+    return stats
+
+
+def build_scorer(args):
+    """Loads or builds the models named by the command-line `args`.
+
+    Returns:
+        scorer (CandidateScorer): Scorer over the models.
+    """
+    if args.lm_snapshot:
+        lm = load_language_model(args.lm_snapshot, args.corpus_dir if args.check_sources else None)
+    elif args.sharded_lm:
+        lm = ShardedLanguageModel(args.sharded_lm, args.shard_memory_budget,
+                                  args.corpus_dir if args.check_sources else None)
+    else:
+        lm = LanguageModel.from_corpus(args.corpus_dir, workers=args.workers)
+
+    if args.edit_model == 'uniform':
+        epm = UniformEditProbabilityModel()
+    elif args.epm_snapshot:
+        epm = load_edit_model(args.epm_snapshot,
+                              args.edit_training_set if args.check_sources else None)
+    else:
+        epm = EmpiricalEditProbabilityModel.from_training_set(args.edit_training_set,
+                                                              workers=args.workers)
+
+    index = None
+    if args.index == 'symmetric-delete':
+        index = SymmetricDeleteIndex(lm, args.max_distance)
+    elif args.index == 'trie':
+        index = VocabularyTrie(lm)
+    cg = CandidateGenerator(lm, epm, index=index, max_distance=args.max_distance,
+                            term_cache_size=args.term_cache_size)
+    return CandidateScorer(lm, cg, mu=args.mu, query_cache_size=args.query_cache_size,
+                           decoding=args.decoding)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Spell-correct queries read from files or stdin, one per line.')
+    parser.add_argument('inputs', nargs='*', default=['-'],
+                        help="files of raw queries ('-' for stdin, the default)")
+
+    models = parser.add_argument_group('models')
+    models.add_argument('--corpus-dir', default='pa2-data/corpus',
+                        help='corpus to build the language model from')
+    models.add_argument('--lm-snapshot', help='prebuilt language model snapshot to load')
+    models.add_argument('--sharded-lm', help='directory of a prebuilt sharded language model')
+    models.add_argument('--shard-memory-budget', type=int, default=1 << 28,
+                        help='bytes of bigram shards a sharded language model may load')
+    models.add_argument('--edit-model', choices=['empirical', 'uniform'], default='empirical')
+    models.add_argument('--edit-training-set', default='pa2-data/training_set/edit1s.txt',
+                        help='training set to build the empirical edit model from')
+    models.add_argument('--epm-snapshot', help='prebuilt edit model snapshot to load')
+    models.add_argument('--check-sources', action='store_true',
+                        help='fail if a snapshot is older than its corpus or training set')
+    models.add_argument('--index', choices=['none', 'symmetric-delete', 'trie'], default='none',
+                        help='vocabulary index for looking up term candidates')
+    models.add_argument('--max-distance', type=int, default=1)
+    models.add_argument('--decoding', choices=['exhaustive', 'lattice', 'vectorized'],
+                        default='exhaustive',
+                        help='decoding of the best correction; --top-k above 1, --scores '
+                             'and --deadline-ms always decode exhaustively')
+    models.add_argument('--mu', type=float, help='weight of the language model '
+                                                 '(default: tuned for the edit model)')
+    models.add_argument('--term-cache-size', type=int, default=0)
+    models.add_argument('--query-cache-size', type=int, default=0)
+
+    run = parser.add_argument_group('execution')
+    run.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    run.add_argument('--chunk-size', type=int, default=64,
+                     help='number of queries sent to a worker at a time')
+    run.add_argument('--window', type=int, help='maximum number of chunks in flight '
+                                                '(default: twice the number of workers)')
+    run.add_argument('--shared-memory', action='store_true',
+                     help='share the models with the workers through shared memory')
+    run.add_argument('--deadline-ms', type=float, help='time budget per query')
+    run.add_argument('--progress', type=float, metavar='SECONDS',
+                     help='report progress to stderr at this interval')
+
+    output = parser.add_argument_group('output')
+    output.add_argument('--top-k', type=int, default=1,
+                        help='output the k best corrections with their scores')
+    output.add_argument('--scores', action='store_true',
+                        help='output scores, even with --top-k 1')
+    output.add_argument('--format', choices=['text', 'jsonl'], default='text',
+                        help="'text': the correction, or tab-separated corrections and scores; "
+                             "'jsonl': one JSON object per query")
+    args = parser.parse_args(argv)
+    if args.deadline_ms is not None and (args.top_k > 1 or args.scores):
+        parser.error('--deadline-ms only returns the best correction, without a score')
+    if args.shared_memory and (args.index != 'none' or args.term_cache_size):
+        parser.error('--shared-memory workers use the default candidate generator')
+    if args.shared_memory and args.edit_model == 'uniform':
+        parser.error('--shared-memory only shares the empirical edit model')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    start = time.perf_counter()
+    cs = build_scorer(args)
+    print('Loaded models in {:.2f}s'.format(time.perf_counter() - start), file=sys.stderr)
+
+    with_scores = args.top_k > 1 or args.scores
+    shared = None
+    scorer_factory = None
+    if args.shared_memory and args.workers > 1:
+        shared = SharedModels(cs.lm, cs.cg.epm)
+        scorer_factory = shared.get_scorer_factory(mu=cs.mu,
+                                                   query_cache_size=args.query_cache_size,
+                                                   decoding=args.decoding)
+    try:
+        stats = correct_stream(read_queries(args.inputs), sys.stdout, cs, workers=args.workers,
+                               chunk_size=args.chunk_size, window=args.window, k=args.top_k,
+                               deadline_ms=args.deadline_ms, output_format=args.format,
+                               with_scores=with_scores, scorer_factory=scorer_factory,
+                               progress_seconds=args.progress)
+    except BrokenPipeError:
+        # The reader of stdout went away (e.g. `| head`): stop quietly
+        sys.stdout = None
+        return 1
+    finally:
+        if shared is not None:
+            shared.close()
+
+    print('Corrected {:,} queries in {:.2f}s with {} worker(s) ({:.1f} queries/s), '
+          '{} error(s), {} cut short by the deadline'.format(
+              stats['queries'], stats['seconds'], args.workers, stats['queries_per_second'],
+              stats['errors'], stats['incomplete']), file=sys.stderr)
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,343 @@
+
+
+def get_percentiles(values, percentiles=(50, 90, 99)):
+    """Gets the nearest-rank percentiles of `values` as a dict 'p50' -> value."""
+    values = sorted(values)
+    if not values:
+        return {'p{}'.format(p): None for p in percentiles}
+    return {'p{}'.format(p): values[min(len(values) - 1, int(math.ceil(p / 100. * len(values))) - 1)]
+            for p in percentiles}
+
+
+def correct_queries(scorer, queries, deadlines_ms=None):
+    """Corrects each of `queries` with `scorer`, so that one failing query does
+    not fail the rest of its batch.
+
+    Args:
+        scorer (CandidateScorer): Scorer to correct the queries with.
+        queries (list of str): Raw queries.
+        deadlines_ms (list): Optional time budget of each query, in
+            milliseconds from the start of the batch, or None for no deadline.
+
+    Returns:
+        results (list): Tuples (correction, completed, error) in the order of
+            `queries`, where completed is False if the deadline cut the
+            search short, and error is None or the message of the exception
+            raised.
+    """
+    start = time.perf_counter()
+    results = []
+    for query, deadline_ms in zip(queries, deadlines_ms or [None] * len(queries)):
+        try:
+            if deadline_ms is None:
+                results.append((scorer.correct_spelling(query), True, None))
+            else:
+                # What is left of the budget after the queries before it
+                remaining_ms = max(0., deadline_ms - (time.perf_counter() - start) * 1000.)
+                correction, completed = scorer.correct_spelling(query, deadline_ms=remaining_ms)
+                results.append((correction, completed, None))
+        except Exception as e:
+            results.append((None, True, repr(e)))
+    return results
+
+
+def correct_queries_in_worker(queries, deadlines_ms=None):
+    """Corrects `queries` with the scorer of the current worker process (see
+    `init_correction_worker`)."""
+    return correct_queries(worker_scorer, queries, deadlines_ms)
+
+
+class SpellingServer:
+    """Asyncio spelling-correction service speaking a line protocol over TCP or
+    a Unix socket.
+
+    Each request is one line: either a raw query, or a JSON object
+    {"query": ..., "deadline_ms": ...}. Each response is one JSON line
+    {"query", "correction", "status", "latency_ms"}, where status is "ok",
+    "deadline_exceeded" (the correction is the best one found by the
+    deadline, or the raw query if its batch did not start in time) or
+    "error" (with the reason in "error").
+    The line "STATS" returns the counters of `get_stats` instead.
+
+    Concurrent requests are collected into micro-batches of at most
+    `max_batch_size` queries, waiting at most `max_batch_delay_ms` for a batch
+    to fill, and each batch is corrected in an executor so that the event loop
+    never blocks on scoring. Up to one batch per worker is corrected at a
+    time; the deadline of a request also stops the search for its correction.
+    """
+
+    def __init__(self, scorer, max_batch_size=32, max_batch_delay_ms=2., workers=0,
+                 scorer_factory=None, default_deadline_ms=None, latency_window=10000):
+        """
+        Args:
+            scorer (CandidateScorer): Scorer to correct queries with.
+            max_batch_size (int): Largest number of queries in a batch.
+            max_batch_delay_ms (float): Longest time to wait for a batch to fill.
+            workers (int): Number of worker processes correcting batches. 0
+                corrects them in a single background thread.
+            scorer_factory (callable): Optional function building the scorer
+                of each worker process (see `correct_spelling_batch`).
+            default_deadline_ms (float): Deadline of requests that do not set
+                one. None means no deadline.
+            latency_window (int): Number of recent latencies kept for stats.
+        """
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay_ms = max_batch_delay_ms
+        self.default_deadline_ms = default_deadline_ms
+        if workers:
+            self.executor = ProcessPoolExecutor(max_workers=workers,
+                                                initializer=init_correction_worker,
+                                                initargs=(scorer_factory or scorer,))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.workers = workers
+
+        self.queue = None
+        self.slots = None         # Semaphore of the executor slots free for a batch
+        self.batch_tasks = set()  # Tasks correcting a batch
+        self.in_flight = set()    # Futures of the requests being corrected
+        self.server = None
+        self.batcher = None
+        self.connections = {}  # Maps connection handler tasks -> their writers
+        self.started_at = None
+        self.latencies_ms = deque(maxlen=latency_window)
+        self.counters = Counter()
+
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        """Starts listening on `host`:`port`, or on the Unix socket `path`.
+
+        Returns:
+            address: The bound (host, port), or `path`.
+        """
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(max(self.workers, 1))
+        self.batcher = asyncio.ensure_future(self.run_batches())
+        self.started_at = time.perf_counter()
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=path)
+            return path
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self, host='127.0.0.1', port=8765, path=None):
+        """Starts the server and serves until cancelled."""
+        address = await self.start(host, port, path)
+        print('Serving spelling corrections on {}'.format(address))
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """Stops accepting connections and shuts down the batcher and workers."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.batcher is not None:
+            self.batcher.cancel()
+        for task in list(self.batch_tasks):
+            task.cancel()
+        # Requests still waiting for a correction are dropped
+        pending = list(self.in_flight)
+        while self.queue is not None and not self.queue.empty():
+            pending.append(self.queue.get_nowait()[2])
+        for future in pending:
+            future.cancel()
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader, writer):
+        """Answers the requests of one connection, in order."""
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip() == b'STATS':
+                    response = self.get_stats()
+                else:
+                    response = await self.handle_request(line)
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self.connections[task]
+            writer.close()
+
+    async def handle_request(self, line):
+        """Parses one request line (bytes) and waits for its correction."""
+        start = time.perf_counter()
+        self.counters['requests'] += 1
+        try:
+            line = line.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            return self.get_error_response(line.decode('utf-8', 'replace').strip(),
+                                           'request is not valid UTF-8')
+        try:
+            request = json.loads(line) if line.startswith('{') else {'query': line}
+            query = request['query']
+        except (ValueError, KeyError):
+            return self.get_error_response(line, 'expected a query or a JSON object with a "query"')
+        deadline_ms = request.get('deadline_ms', self.default_deadline_ms)
+        if deadline_ms is not None and (isinstance(deadline_ms, bool)
+                                        or not isinstance(deadline_ms, (int, float))):
+            return self.get_error_response(query, '"deadline_ms" must be a number')
+
+        deadline = None if deadline_ms is None else start + deadline_ms / 1000.
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, deadline, future))
+
+        try:
+            timeout = None if deadline is None else max(0., deadline - time.perf_counter())
+            try:
+                correction, completed = await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                if future not in self.in_flight:
+                    raise
+                # Its search stops at the deadline, with the best correction so far
+                correction, completed = await future
+            status, error = 'ok' if completed else 'deadline_exceeded', None
+        except asyncio.TimeoutError:
+            correction, status, error = query, 'deadline_exceeded', None
+        except Exception as e:
+            correction, status, error = None, 'error', str(e)
+        self.counters[status] += 1
+
+        latency_ms = (time.perf_counter() - start) * 1000.
+        self.latencies_ms.append(latency_ms)
+        response = {'query': query, 'correction': correction, 'status': status,
+                    'latency_ms': latency_ms}
+        if error is not None:
+            response['error'] = error
+        return response
+
+    def get_error_response(self, query, error):
+        """Gets the response to a request that could not be parsed."""
+        self.counters['error'] += 1
+        return {'query': query, 'correction': None, 'status': 'error', 'latency_ms': 0.,
+                'error': error}
+
+    async def run_batches(self):
+        """Collects queued requests into micro-batches, and starts correcting
+        each as soon as an executor slot is free."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            batch_deadline = loop.time() + self.max_batch_delay_ms / 1000.
+            while len(batch) < self.max_batch_size:
+                timeout = batch_deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.slots.acquire()
+
+            # Requests whose deadline already passed are answered uncorrected
+            now = time.perf_counter()
+            batch = [(query, deadline, future) for query, deadline, future in batch
+                     if not future.done() and (deadline is None or deadline > now)]
+            if not batch:
+                self.slots.release()
+                continue
+
+            self.counters['batches'] += 1
+            self.counters['batched_queries'] += len(batch)
+            self.in_flight.update(future for _, _, future in batch)
+            task = asyncio.ensure_future(self.correct_batch(batch))
+            self.batch_tasks.add(task)
+            task.add_done_callback(self.batch_tasks.discard)
+
+    async def correct_batch(self, batch):
+        """Corrects one batch in the executor, frees its slot, and resolves the
+        futures of its requests."""
+        loop = asyncio.get_running_loop()
+        queries = [query for query, _, _ in batch]
+        now = time.perf_counter()
+        deadlines_ms = [None if deadline is None else (deadline - now) * 1000.
+                        for _, deadline, _ in batch]
+        try:
+            if self.workers:
+                results = await loop.run_in_executor(
+                    self.executor, correct_queries_in_worker, queries, deadlines_ms)
+            else:
+                results = await loop.run_in_executor(
+                    self.executor, correct_queries, self.scorer, queries, deadlines_ms)
+        except Exception as e:  # E.g. a worker process died
+            results = [(None, True, repr(e))] * len(batch)
+        finally:
+            self.slots.release()
+        for (_, _, future), (correction, completed, error) in zip(batch, results):
+            self.in_flight.discard(future)
+            if future.done():
+                continue
+            if error is None:
+                future.set_result((correction, completed))
+            else:
+                future.set_exception(RuntimeError(error))
+
+    def get_stats(self):
+        """Gets request counters, batch sizes, latency percentiles (over the
+        last `latency_window` requests) and throughput since `start`."""
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.
+        stats = dict(self.counters)
+        stats['mean_batch_size'] = (self.counters['batched_queries'] / self.counters['batches']
+                                    if self.counters['batches'] else 0.)
+        stats['uptime_s'] = elapsed
+        stats['requests_per_second'] = self.counters['requests'] / elapsed if elapsed else 0.
+        stats['latency_ms'] = get_percentiles(self.latencies_ms)
+        return stats
+
+
+async def run_load_test(queries, host='127.0.0.1', port=8765, path=None, concurrency=16,
+                        deadline_ms=None):
+    """Load-generator client for `SpellingServer`: sends `queries` over
+    `concurrency` connections, each with one request in flight at a time.
+
+    Returns:
+        report (dict): Client-side counts, throughput and latency percentiles,
+            plus the server's own stats.
+    """
+    pending = iter(queries)
+    latencies_ms = []
+    statuses = Counter()
+
+    async def open_connection():
+        if path is not None:
+            return await asyncio.open_unix_connection(path)
+        return await asyncio.open_connection(host, port)
+
+    async def client():
+        reader, writer = await open_connection()
+        for query in pending:
+            request = {'query': query}
+            if deadline_ms is not None:
+                request['deadline_ms'] = deadline_ms
+            start = time.perf_counter()
+            writer.write(json.dumps(request).encode('utf-8') + b'\n')
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies_ms.append((time.perf_counter() - start) * 1000.)
+            statuses[response['status']] += 1
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await open_connection()
+    writer.write(b'STATS\n')
+    await writer.drain()
+    server_stats = json.loads(await reader.readline())
+    writer.close()
+
+    return {'requests': len(latencies_ms), 'statuses': dict(statuses), 'seconds': elapsed,
+            'requests_per_second': len(latencies_ms) / elapsed if elapsed else 0.,
+            'latency_ms': get_percentiles(latencies_ms), 'server': server_stats}
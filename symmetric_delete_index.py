@@ -0,0 +1,89 @@
+
+
+class SymmetricDeleteIndex:
+    """Precomputed symmetric-delete (SymSpell-style) index over the vocabulary
+    of a `LanguageModel`. Maps every string obtained by deleting up to
+    `max_distance` characters from a vocabulary word back to that word, so that
+    a lookup only touches real vocabulary candidates instead of every string
+    within a few edits of the term.
+    """
+
+    def __init__(self, lm, max_distance=2):
+        """
+        Args:
+            lm (LanguageModel): Language model whose vocabulary to index.
+            max_distance (int): Largest edit distance supported by `lookup`.
+        """
+        self.max_distance = max_distance
+        self.deletes = {}  # Maps delete-variant -> set of vocabulary words
+
+        for word in lm.unigram_counts:
+            self.add_word(word)
+        lm.add_vocabulary_listener(self.update_vocabulary)
+
+    def get_deletes(self, term, max_distance):
+        """Gets all strings obtained by deleting at most `max_distance`
+        characters from `term`, including `term` itself."""
+        deletes = {term}
+        frontier = {term}
+        for _ in range(max_distance):
+            next_frontier = set()
+            for variant in frontier:
+                for x in range(len(variant)):
+                    next_frontier.add(variant[:x] + variant[x + 1:])
+            next_frontier -= deletes
+            deletes |= next_frontier
+            frontier = next_frontier
+        return deletes
+
+    def add_word(self, word):
+        """Adds `word` to the index."""
+        for variant in self.get_deletes(word, self.max_distance):
+            self.deletes.setdefault(variant, set()).add(word)
+
+    def remove_word(self, word):
+        """Removes `word` from the index."""
+        for variant in self.get_deletes(word, self.max_distance):
+            words = self.deletes.get(variant)
+            if words is not None:
+                words.discard(word)
+                if not words:
+                    del self.deletes[variant]
+
+    def update_vocabulary(self, added_words, removed_words):
+        """Keeps the index in sync with the vocabulary of its `LanguageModel`
+        (see `LanguageModel.add_vocabulary_listener`)."""
+        for word in removed_words:
+            self.remove_word(word)
+        for word in added_words:
+            self.add_word(word)
+
+    def lookup(self, term, max_distance=1):
+        """Gets all indexed words within `max_distance` edits of `term`.
+
+        Args:
+            term (str): Term to look up.
+            max_distance (int): Largest edit distance to return. Must not exceed
+                the `max_distance` the index was built with.
+
+        Returns:
+            words (list): List of tuples (word, distance), where distance is the
+                optimal string alignment distance from `term` to `word`.
+        """
+        if max_distance > self.max_distance:
+            raise ValueError('Index was built for distance <= {}, got {}'.format(
+                self.max_distance, max_distance))
+
+        seen = set()
+        words = []
+        for variant in self.get_deletes(term, max_distance):
+            for word in self.deletes.get(variant, ()):
+                if word in seen:
+                    continue
+                seen.add(word)
+                if abs(len(word) - len(term)) > max_distance:
+                    continue
+                distance = get_osa_distance(term, word)
+                if distance <= max_distance:
+                    words.append((word, distance))
+        return words
@@ -0,0 +1,120 @@
+
+
+class VocabularyTrie:
+    """Trie over the vocabulary of a `LanguageModel`. Finds all vocabulary words
+    within a bounded Damerau-Levenshtein (optimal string alignment) distance of
+    a term by walking the trie one row of the distance table at a time, and
+    pruning every subtree whose row can no longer get back under the bound.
+
+    Can be used in place of `SymmetricDeleteIndex` as the `index` of a
+    `CandidateGenerator`. It is much smaller than a distance-2 delete index, so
+    it is the cheaper way to look up distance-2 candidates for every term.
+    """
+
+    WORD_END = None  # Key under which a node stores the word ending at it
+
+    def __init__(self, lm):
+        """
+        Args:
+            lm (LanguageModel): Language model whose vocabulary to index.
+        """
+        self.root = {}
+        for word in lm.unigram_counts:
+            self.add_word(word)
+        lm.add_vocabulary_listener(self.update_vocabulary)
+
+    def add_word(self, word):
+        """Adds `word` to the trie."""
+        node = self.root
+        for char in word:
+            node = node.setdefault(char, {})
+        node[self.WORD_END] = word
+
+    def remove_word(self, word):
+        """Removes `word` from the trie, with the nodes only it used."""
+        path = [self.root]
+        for char in word:
+            node = path[-1].get(char)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].pop(self.WORD_END, None)
+        for depth in range(len(word), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][word[depth - 1]]
+
+    def update_vocabulary(self, added_words, removed_words):
+        """Keeps the trie in sync with the vocabulary of its `LanguageModel`
+        (see `LanguageModel.add_vocabulary_listener`)."""
+        for word in removed_words:
+            self.remove_word(word)
+        for word in added_words:
+            self.add_word(word)
+
+    def get_prefix_words(self, text, start=0):
+        """Gets the end positions of the words in the trie that `text` contains
+        starting at position `start`, i.e. every end such that text[start:end]
+        is a word, in increasing order."""
+        ends = []
+        node = self.root
+        for end in range(start, len(text)):
+            node = node.get(text[end])
+            if node is None:
+                break
+            if self.WORD_END in node:
+                ends.append(end + 1)
+        return ends
+
+    def lookup(self, term, max_distance=1):
+        """Gets all words in the trie within `max_distance` edits of `term`.
+
+        Args:
+            term (str): Term to look up.
+            max_distance (int): Largest edit distance to return.
+
+        Returns:
+            words (list): List of tuples (word, distance), where distance is the
+                optimal string alignment distance from `term` to `word`.
+        """
+        words = []
+        first_row = [min(j, max_distance + 1) for j in range(len(term) + 1)]
+        for char, child in self.root.items():
+            if char is not self.WORD_END:
+                self._search(child, char, 1, term, first_row, None, None,
+                             max_distance, words)
+        return words
+
+    def _search(self, node, char, depth, term, prev_row, prev_prev_row,
+                prev_char, max_distance, words):
+        """Computes the distance-table row for the prefix of length `depth`
+        ending in `char` at `node`, records a word ending here if it is close
+        enough, and recurses into the children unless no extension of the
+        prefix can be. Only the band of cells within `max_distance` of the
+        diagonal is computed; everything outside it is capped at
+        `max_distance + 1`.
+        """
+        cap = max_distance + 1
+        row = [cap] * (len(term) + 1)
+        row[0] = depth if depth < cap else cap
+        for j in range(max(1, depth - max_distance), min(len(term), depth + max_distance) + 1):
+            distance = prev_row[j - 1] if term[j - 1] == char else prev_row[j - 1] + 1
+            if prev_row[j] + 1 < distance:
+                distance = prev_row[j] + 1
+            if row[j - 1] + 1 < distance:
+                distance = row[j - 1] + 1
+            if (prev_prev_row is not None and j > 1 and term[j - 1] == prev_char
+                    and term[j - 2] == char and prev_prev_row[j - 2] + 1 < distance):
+                distance = prev_prev_row[j - 2] + 1
+            row[j] = distance if distance < cap else cap
+
+        word = node.get(self.WORD_END)
+        if word is not None and row[-1] <= max_distance:
+            words.append((word, row[-1]))
+
+        # A transposition can still reach back to the previous row
+        if min(row) <= max_distance or min(prev_row) < max_distance:
+            for next_char, child in node.items():
+                if next_char is not self.WORD_END:
+                    self._search(child, next_char, depth + 1, term, row, prev_row,
+                                 char, max_distance, words)
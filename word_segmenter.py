@@ -0,0 +1,155 @@
+
+
+class WordSegmenter:
+    """Finds the likeliest ways to re-segment a query into vocabulary words by
+    inserting and deleting spaces anywhere, e.g. "newyorktimes" -> "new york
+    times" or "new yor ktimes" -> "new york times".
+
+    The query's tokens are concatenated, and a dynamic program runs over the
+    characters: a word ending at character j extends the hypotheses ending
+    where the word starts, and the words starting at a position are found by
+    walking a `VocabularyTrie` along the text. Each hypothesis is scored with
+    the edit log-probability of every space it inserts or deletes plus `mu`
+    times its bigram `LanguageModel` log-probability, and only the best `beam`
+    hypotheses are kept per position, so the work is linear in the number of
+    characters (times the longest word and the beam width).
+    """
+
+    def __init__(self, lm, epm, trie=None, mu=1., beam=8, num_segmentations=5):
+        """
+        Args:
+            lm (LanguageModel): Language model for scoring the words.
+            epm (EditProbabilityModel): Edit probability model for scoring
+                inserted and deleted spaces.
+            trie (VocabularyTrie): Trie over the vocabulary of `lm`. Built if
+                not given.
+            mu (float): Weighting factor for the language model.
+            beam (int): Number of hypotheses kept per character position.
+            num_segmentations (int): Number of segmentations to return.
+        """
+        self.lm = lm
+        self.epm = epm
+        self.trie = trie if trie is not None else VocabularyTrie(lm)
+        self.mu = mu
+        self.beam = beam
+        self.num_segmentations = num_segmentations
+
+    def get_space_edit_logp(self, text, x, boundaries):
+        """Gets the edit log-probability of changing whether the query has a
+        space before character `x` of `text`: of deleting the space if `x` is
+        in `boundaries` (as for a merged candidate in
+        `CandidateGenerator.get_candidates`), or of inserting one otherwise."""
+        joined = text[x - 1] + text[x]
+        spaced = text[x - 1] + ' ' + text[x]
+        if x in boundaries:
+            return self.epm.get_edit_logp(joined, spaced)
+        return self.epm.get_edit_logp(spaced, joined)
+
+    def segment(self, tokens):
+        """Finds the best segmentations of the concatenation of `tokens`.
+
+        Returns:
+            segmentations (list): Up to `num_segmentations` tuples
+                (score, space_edit_logp, num_space_edits, words), best first.
+        """
+        text = ''.join(tokens)
+        boundaries = set()  # Positions of the spaces of the query in `text`
+        position = 0
+        for token in tokens[:-1]:
+            position += len(token)
+            boundaries.add(position)
+        # Space edit log-probabilities, computed only at the positions the
+        # program reaches, since the edit model may not score the others
+        space_edit_logps = {}
+
+        def get_space_edit_logp(x):
+            logp = space_edit_logps.get(x)
+            if logp is None:
+                logp = space_edit_logps[x] = self.get_space_edit_logp(text, x, boundaries)
+            return logp
+
+        # hypotheses[i] holds the best tuples (score, edit_logp, num_edits,
+        # words) of segmentations of text[:i], where words is a linked list
+        # (last word, previous words)
+        hypotheses = [[] for _ in range(len(text) + 1)]
+        hypotheses[0].append((0., 0., 0, None))
+        for start in range(len(text)):
+            if not hypotheses[start]:
+                continue
+            ends = self.trie.get_prefix_words(text, start)
+            if not ends:
+                continue
+            # Cost of the space before the word, if it was inserted
+            start_logp, start_edits = 0., 0
+            if start > 0 and start not in boundaries:
+                start_logp, start_edits = get_space_edit_logp(start), 1
+
+            deleted_logp, deleted_edits = 0., 0
+            prev_end = start + 1
+            for end in ends:
+                # Spaces of the query inside the word are deleted
+                for x in range(prev_end, end):
+                    if x in boundaries:
+                        deleted_logp += get_space_edit_logp(x)
+                        deleted_edits += 1
+                prev_end = end
+                word = text[start:end]
+
+                for score, edit_logp, num_edits, words in hypotheses[start]:
+                    if words is None:
+                        lm_logp = self.lm.get_unigram_logp(word)
+                    else:
+                        lm_logp = self.lm.get_bigram_logp(words[0], word)
+                    word_edit_logp = start_logp + deleted_logp
+                    hypotheses[end].append((score + word_edit_logp + self.mu * lm_logp,
+                                            edit_logp + word_edit_logp,
+                                            num_edits + start_edits + deleted_edits,
+                                            (word, words)))
+                if len(hypotheses[end]) > self.beam:
+                    hypotheses[end] = heapq.nlargest(self.beam, hypotheses[end],
+                                                     key=lambda hypothesis: hypothesis[0])
+            hypotheses[start] = None  # No longer needed
+
+        segmentations = []
+        for score, edit_logp, num_edits, words in sorted(hypotheses[-1], key=lambda h: -h[0]):
+            word_list = []
+            while words is not None:
+                word, words = words
+                word_list.append(word)
+            segmentations.append((score, edit_logp, num_edits, tuple(reversed(word_list))))
+        return segmentations[:self.num_segmentations]
+
+    def get_segmentation_edits(self, tokens, min_space_edits=2):
+        """Gets the best segmentations of `tokens` that insert or delete at
+        least `min_space_edits` spaces, described like the candidates of
+        `CandidateGenerator.get_candidate_edits`. Single space edits are
+        left out by default, since the generator already proposes those.
+
+        Returns:
+            edits (list): Tuples (space_edit_logp, spans), where spans replace
+                the changed token ranges with their new words.
+        """
+        token_ends = {}
+        end = 0
+        for i, token in enumerate(tokens):
+            end += len(token)
+            token_ends[end] = i + 1
+
+        edits = []
+        for _, edit_logp, num_edits, words in self.segment(tokens):
+            if num_edits < min_space_edits:
+                continue
+            # Cut the segmentation wherever it shares a boundary with the
+            # query; the words between two shared boundaries replace the
+            # tokens between them, unless they are the same single token
+            spans = []
+            start_token, start_word, end = 0, 0, 0
+            for i, word in enumerate(words):
+                end += len(word)
+                if end in token_ends:
+                    end_token = token_ends[end]
+                    if not (end_token - start_token == 1 and i + 1 - start_word == 1):
+                        spans.append((start_token, end_token, words[start_word:i + 1]))
+                    start_token, start_word = end_token, i + 1
+            edits.append((edit_logp, tuple(spans)))
+        return edits